@@ -23,21 +23,18 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os import unlink
-from os.path import exists
 
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 
-from lucterios.framework.filetools import save_from_base64, get_user_path, open_image_resize, readimage_to_base64
+from lucterios.framework.filetools import save_from_base64, get_user_path
 from lucterios.framework.xfercomponents import XferCompEdit, XferCompFloat, XferCompCheck, XferCompSelect, \
     XferCompMemo, XferCompUpLoad, XferCompImage, XferCompButton, XferCompLinkLabel
 from lucterios.framework.tools import FORMTYPE_REFRESH, FORMTYPE_MODAL, CLOSE_NO, CLOSE_YES, get_icon_path, WrapAction
 from lucterios.framework.tools import ActionsManage
 from lucterios.framework.editors import LucteriosEditor
 
-from lucterios.contacts.models import PostalCode, CustomField
-from lucterios.CORE.parameters import Params
+from lucterios.contacts.models import PostalCodeIndex, CustomField, ContactImageCache
 from lucterios.framework import signal_and_lock
 from lucterios.CORE.views import ObjectPromote
 
@@ -115,7 +112,7 @@ parent.get('args_list').setVisible(type==4);
                     args[arg_name] = (args_val != 'False') and (args_val != '0') and (args_val != '') and (args_val != 'n')
                 else:
                     args[arg_name] = float(args_val)
-        self.item.args = six.text_type(args)
+        self.item.set_args(args)
         LucteriosEditor.saving(self, xfer)
         self.item.save()
 
@@ -183,8 +180,7 @@ class AbstractContactEditor(LucteriosEditor):
         obj_pstcd.set_action(xfer.request, xfer.get_action(), modal=FORMTYPE_REFRESH, close=CLOSE_NO)
         obj_city = xfer.get_components('city')
         postalcode_current = obj_pstcd.value
-        list_postalcode = PostalCode.objects.filter(
-            postal_code=postalcode_current)
+        list_postalcode = PostalCodeIndex.get_entries(postalcode_current)
         if len(list_postalcode) > 0:
             self._change_city_select(xfer, list_postalcode, obj_city)
         obj_cmt = xfer.get_components('comment')
@@ -208,11 +204,11 @@ class AbstractContactEditor(LucteriosEditor):
         xfer.tab = obj_addr.tab
         new_col = obj_addr.col
         xfer.move(obj_addr.tab, 1, 0)
-        img_path = get_user_path("contacts", "Image_%s.jpg" % self.item.abstractcontact_ptr_id)
+        img_value = ContactImageCache.read_image(get_user_path("contacts", "Image_%s.jpg" % self.item.abstractcontact_ptr_id))
         img = XferCompImage('logoimg')
-        if exists(img_path):
+        if img_value is not None:
             img.type = 'jpg'
-            img.set_value(readimage_to_base64(img_path))
+            img.set_value(img_value)
         else:
             img.set_value(get_icon_path("lucterios.contacts/images/NoImage.png"))
         img.set_location(new_col, obj_addr.row, 1, 6)
@@ -229,36 +225,25 @@ class AbstractContactEditor(LucteriosEditor):
     def saving(self, xfer):
         uploadlogo = xfer.getparam('uploadlogo')
         if uploadlogo is not None:
-            tmp_file = save_from_base64(uploadlogo)
-            with open(tmp_file, "rb") as image_tmp:
-                image = open_image_resize(image_tmp, 100, 100)
-                image = image.convert("RGB")
-                img_path = get_user_path("contacts", "Image_%s.jpg" % self.item.abstractcontact_ptr_id)
-                with open(img_path, "wb") as image_file:
-                    image.save(image_file, 'JPEG', quality=90)
-            unlink(tmp_file)
+            ContactImageCache.add_upload(self.item.abstractcontact_ptr_id, save_from_base64(uploadlogo))
         LucteriosEditor.saving(self, xfer)
         self.item.set_custom_values(xfer.params)
 
-    def add_email_selector(self, xfer, col, row, colspan):
+    def add_email_selector(self, xfer, col, row, colspan, email_action=None):
         contacts_list = xfer.items.exclude(email__isnull=True).exclude(email__exact='')
-        if len(contacts_list) < 100:
-            mailto_type = Params.getvalue("contacts-mailtoconfig")
-            email_list = []
-            for item in contacts_list:
-                email_list.append(six.text_type(item.email))
+        email_list = [six.text_type(email) for email in contacts_list.values_list('email', flat=True)[:100]]
+        if len(email_list) < 100:
             if len(email_list) > 0:
                 link = XferCompLinkLabel('emailAll')
                 link.set_value_center(_('Write to all'))
-                if mailto_type == 1:  # CC
-                    mailto_prefix = 'mailto:?cc='
-                elif mailto_type == 2:  # BCC
-                    mailto_prefix = 'mailto:?bcc='
-                else:  # TO
-                    mailto_prefix = 'mailto:'
-                link.set_link(mailto_prefix + ','.join(email_list))
+                link.set_link(self.item.get_mailto_prefix() + ','.join(email_list))
                 link.set_location(col, row, colspan)
                 xfer.add_component(link)
+        elif email_action is not None:
+            btn = XferCompButton('emailAll')
+            btn.set_action(xfer.request, email_action, modal=FORMTYPE_MODAL, close=CLOSE_NO)
+            btn.set_location(col, row, colspan)
+            xfer.add_component(btn)
 
 
 class LegalEntityEditor(AbstractContactEditor):
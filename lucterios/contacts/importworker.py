@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+'''
+lucterios.contacts package
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+import pickle
+
+import django
+
+_import_validator = None
+
+
+def init_import_worker(validator_data):
+    global _import_validator
+    django.setup()
+    from django.db import connections
+    for db_connection in connections.all():
+        db_connection.close_if_unusable_or_obsolete()
+    _import_validator = pickle.loads(validator_data)
+
+
+def validate_import_chunk(rows):
+    return _import_validator.validate(rows)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+'''
+Maintenance command: measure the speed of contact import
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from time import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lucterios.contacts.models import Individual
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Import generated individuals and report the number of rows by second (database unchanged unless --keep).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='number of generated rows')
+        parser.add_argument('--batch-size', type=int, default=None, help='number of rows by chunk')
+        parser.add_argument('--workers', type=int, default=0, help='number of validation processes (0: validate in the writer)')
+        parser.add_argument('--compare', action='store_true', default=False, help='also measure the row-by-row import')
+        parser.add_argument('--keep', action='store_true', default=False, help='keep the imported contacts')
+
+    def get_rows(self, nb_rows):
+        for row_idx in range(nb_rows):
+            yield {'lastname': 'BENCH%06d' % row_idx, 'firstname': 'Contact', 'genre': '1',
+                   'address': '%d rue du test' % row_idx, 'postal_code': '%05d' % (row_idx % 99999), 'city': 'BENCHVILLE',
+                   'tel1': '01%08d' % row_idx, 'email': 'bench%06d@example.com' % row_idx}
+
+    def run_batched(self, options):
+        importer = Individual.get_importer('%d/%m/%Y', workers=options['workers'])
+        if options['batch_size'] is not None:
+            importer.BatchSize = options['batch_size']
+        importer.run(self.get_rows(options['rows']))
+        self.stdout.write("batched (%d workers): %d rows, %d imported, %d errors in %.2fs: %.0f rows/s" % (importer.workers, importer.nb_rows, len(importer.imported_ids), len(importer.errors), importer.duration, importer.rows_per_second))
+
+    def run_row_by_row(self, options):
+        start_time = time()
+        Individual.initialize_import()
+        nb_imported = 0
+        for rowdata in self.get_rows(options['rows']):
+            if Individual.import_data(rowdata, '%d/%m/%Y') is not None:
+                nb_imported += 1
+        Individual.finalize_import()
+        duration = time() - start_time
+        self.stdout.write("row by row: %d rows, %d imported in %.2fs: %.0f rows/s" % (options['rows'], nb_imported, duration, options['rows'] / duration if duration > 0 else 0.0))
+
+    def handle(self, *args, **options):
+        benchmarks = [self.run_batched]
+        if options['compare']:
+            benchmarks.append(self.run_row_by_row)
+        for benchmark in benchmarks:
+            try:
+                with transaction.atomic():
+                    benchmark(options)
+                    if not options['keep']:
+                        raise BenchmarkRollback()
+            except BenchmarkRollback:
+                pass
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''
+Maintenance command: show plans and timings of contact queries
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from time import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from lucterios.contacts.models import Individual, AbstractContact, CustomField, ContactCustomField, ContactBlockingKey, \
+    ContactSearchEngine
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Generate individuals then show the plan and the duration of list, search, duplicate and recipient queries (database unchanged unless --keep).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contacts', type=int, default=200000, help='number of generated individuals')
+        parser.add_argument('--keep', action='store_true', default=False, help='keep the generated contacts')
+
+    def get_rows(self, nb_contacts, custom_name):
+        for row_idx in range(nb_contacts):
+            contact_idx = row_idx - 1 if (row_idx % 10) == 1 else row_idx
+            yield {'lastname': 'BENCH%06d' % row_idx, 'firstname': 'Contact', 'genre': '1',
+                   'address': '%d rue du test' % row_idx, 'postal_code': '%05d' % (row_idx % 99999), 'city': 'BENCHVILLE',
+                   'tel1': '01%08d' % contact_idx, 'email': 'bench%06d@example.com' % contact_idx,
+                   custom_name: 'value %d' % (row_idx % 100)}
+
+    def get_queries(self, custom_field):
+        page_ids = list(Individual.objects.order_by('lastname', 'firstname', 'pk').values_list('pk', flat=True)[1000:1025])
+        return [
+            ('list', Individual.objects.order_by('lastname', 'firstname', 'pk')[1000:1025], None),
+            ('search by name', Individual.objects.filter(ContactSearchEngine.get_filter('bench012345')), None),
+            ('search by e-mail', AbstractContact.objects.filter(email='bench012340@example.com'), None),
+            ('duplicate keys', ContactBlockingKey.objects.filter(contact_type=Individual.get_long_name(), kind=1, value='bench012340@example.com'), None),
+            ('duplicate candidates', None, lambda: ContactBlockingKey.get_candidates(Individual.get_long_name())),
+            ('recipients', AbstractContact.objects.filter(id__in=page_ids).exclude(email=''), lambda: list(AbstractContact.get_emails_by_contact(Individual.objects.filter(id__in=page_ids)).items())),
+            ('distinct e-mails', Individual.objects.exclude(email='').annotate(email_key=Lower('email')).order_by('email_key').values_list('email_key', 'email'),
+             lambda: list(AbstractContact.iter_distinct_emails(Individual.objects.all()))),
+            ('custom values', ContactCustomField.objects.filter(contact_id__in=page_ids, field=custom_field), None),
+        ]
+
+    def show_query(self, name, query_set, query_fct):
+        self.stdout.write("== %s" % name)
+        if query_set is not None:
+            self.stdout.write(query_set.explain())
+        start_time = time()
+        result = query_fct() if query_fct is not None else list(query_set)
+        self.stdout.write("%d result(s) in %.1f ms" % (len(result), (time() - start_time) * 1000))
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                custom_field = CustomField.objects.create(name='benchmark', modelname='contacts.AbstractContact', kind=0,
+                                                          args="{'multi':False, 'min':0, 'max':0, 'prec':0, 'list':[]}")
+                importer = Individual.get_importer('%d/%m/%Y')
+                importer.run(self.get_rows(options['contacts'], custom_field.get_fieldname()))
+                self.stdout.write("%d contacts generated in %.1fs" % (len(importer.imported_ids), importer.duration))
+                for name, query_set, query_fct in self.get_queries(custom_field):
+                    self.show_query(name, query_set, query_fct)
+                if not options['keep']:
+                    raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+'''
+Maintenance command: load postal code datasets
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lucterios.contacts.models import PostalCodeLoader
+
+
+class Command(BaseCommand):
+    help = 'Load postal codes from CSV files (optionally gzip-compressed): only rows not already known are inserted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='CSV files "postal code;city;country" (default: the datasets shipped with contacts)')
+        parser.add_argument('--country', default=None, help='load only the rows of this country')
+        parser.add_argument('--replace', action='store_true', default=False, help='with --country, remove the postal codes of this country missing from the files')
+        parser.add_argument('--batch-size', type=int, default=None, help='number of rows by insert')
+
+    def handle(self, *args, **options):
+        if options['replace'] and (options['country'] is None):
+            raise CommandError('--replace needs --country')
+        file_list = options['files']
+        if len(file_list) == 0:
+            file_list = [PostalCodeLoader.get_dataset_path(file_name) for file_name in PostalCodeLoader.DatasetFiles]
+        loader = PostalCodeLoader(batch_size=options['batch_size'])
+        nb_created, nb_deleted = loader.load_files(file_list, options['country'], options['replace'], self.write_progress)
+        self.stdout.write("%d postal code(s) created, %d deleted" % (nb_created, nb_deleted))
+
+    def write_progress(self, file_name, nb_read, nb_created, duration):
+        self.stdout.write("%s: %d read, %d created in %.2fs" % (file_name, nb_read, nb_created, duration))
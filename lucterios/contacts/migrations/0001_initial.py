@@ -25,11 +25,10 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 from os.path import dirname, join, isfile
-from logging import getLogger
+import codecs
 import sys
 
-from django.db import models, migrations, transaction
-from django.db.utils import IntegrityError
+from django.db import models, migrations
 from django.conf import settings
 from django.utils import six
 
@@ -50,31 +49,20 @@ def initial_values(apps, schema_editor):
     PrintModel().load_model('lucterios.contacts', "Individual_0002", is_default=True)
 
 
-def save_postalcodes(postalcode, pc_list):
-    try:
-        with transaction.atomic():
-            postalcode.objects.bulk_create(pc_list)
-    except IntegrityError as err:
-        getLogger(__name__).warning(
-            six.text_type(" --- IntegrityError:") + six.text_type(err))
-    return []
-
-
-def import_file_postalcode(postalcode, migrat_file):
-    import codecs
-    pc_list = []
-    if isfile(migrat_file):
-        with codecs.open(migrat_file, 'r', 'utf-8') as flpc:
-            for line in flpc.readlines():
-                postal_code, city, country = six.text_type(line).split(';')[:3]
-                newpc = postalcode()
-                newpc.postal_code = six.text_type(postal_code).strip()
-                newpc.city = six.text_type(city).strip()
-                newpc.country = six.text_type(country).strip()
-                pc_list.append(newpc)
-                if len(pc_list) > 900:
-                    pc_list = save_postalcodes(postalcode, pc_list)
-    return pc_list
+def load_postalcodes(postalcode, file_names):
+    migrat_dir = dirname(__file__)
+    pc_keys = set()
+    for file_name in file_names:
+        migrat_file = join(migrat_dir, file_name)
+        if isfile(migrat_file):
+            with codecs.open(migrat_file, 'r', 'utf-8') as flpc:
+                for line in flpc:
+                    values = [six.text_type(value).strip() for value in line.split(';')[:3]]
+                    if (len(values) == 3) and ('' not in values):
+                        pc_keys.add(tuple(values))
+    pc_keys -= set(postalcode.objects.values_list('postal_code', 'city', 'country'))
+    postalcode.objects.bulk_create([postalcode(postal_code=postal_code, city=city, country=country)
+                                    for postal_code, city, country in sorted(pc_keys)], batch_size=900)
 
 
 def initial_postalcodes(apps, schema_editor):
@@ -96,13 +84,7 @@ def initial_postalcodes(apps, schema_editor):
         pcfile_list.append("postalcode_fr12.csv")
         pcfile_list.append("postalcode_fr13.csv")
         pcfile_list.append("postalcode_fr14.csv")
-    pc_list = []
-    migrat_dir = dirname(__file__)
-    for pcfile in pcfile_list:
-        pc_list.extend(
-            import_file_postalcode(postalcode, join(migrat_dir, pcfile)))
-    if len(pc_list) > 0:
-        pc_list = save_postalcodes(postalcode, pc_list)
+    load_postalcodes(postalcode, pcfile_list)
 
 
 class Migration(migrations.Migration):
@@ -24,7 +24,6 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os.path import dirname, join
 import sys
 
 from django.db import migrations
@@ -33,19 +32,12 @@ from django.utils.module_loading import import_module
 
 def addon_postalcodes(apps, schema_editor):
     init_module = import_module("lucterios.contacts.migrations.0001_initial")
-    import_file_postalcode = getattr(init_module, "import_file_postalcode")
-    save_postalcodes = getattr(init_module, "save_postalcodes")
+    load_postalcodes = getattr(init_module, "load_postalcodes")
     postalcode = apps.get_model("contacts", "PostalCode")
     pcfile_list = []
     if not (len(sys.argv) >= 2) or (sys.argv[1] != 'test'):
         pcfile_list.append("postalcode_be.csv")
-    pc_list = []
-    migrat_dir = dirname(__file__)
-    for pcfile in pcfile_list:
-        pc_list.extend(
-            import_file_postalcode(postalcode, join(migrat_dir, pcfile)))
-    if len(pc_list) > 0:
-        pc_list = save_postalcodes(postalcode, pc_list)
+    load_postalcodes(postalcode, pcfile_list)
 
 
 class Migration(migrations.Migration):
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Convert custom field arguments to JSON
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+import json
+import ast
+
+from django.db import migrations
+
+
+def convert_args_to_json(apps, schema_editor):
+    custom_field = apps.get_model("contacts", "CustomField")
+    for cf_item in custom_field.objects.all():
+        try:
+            json.loads(cf_item.args)
+            continue
+        except ValueError:
+            pass
+        try:
+            args = ast.literal_eval(cf_item.args)
+        except (ValueError, SyntaxError):
+            args = {}
+        if not isinstance(args, dict):
+            args = {}
+        if 'list' in args.keys():
+            args['list'] = list(args['list'])
+        cf_item.args = json.dumps(args, sort_keys=True)
+        cf_item.save(update_fields=['args'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0004_length_field'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_args_to_json, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Typed and indexed storage of custom field values
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_typed_values(apps, schema_editor):
+    contact_custom_field = apps.get_model("contacts", "ContactCustomField")
+    ccf_list = []
+    for ccf_item in contact_custom_field.objects.exclude(value='').filter(field__kind__in=(1, 2, 3, 4)).select_related('field'):
+        try:
+            if ccf_item.field.kind in (1, 4):
+                ccf_item.int_value = int(ccf_item.value)
+            if ccf_item.field.kind == 2:
+                ccf_item.real_value = float(ccf_item.value)
+            if ccf_item.field.kind == 3:
+                ccf_item.bool_value = (ccf_item.value != 'False') and (ccf_item.value != '0') and (ccf_item.value != 'n')
+        except ValueError:
+            continue
+        ccf_list.append(ccf_item)
+    contact_custom_field.objects.bulk_update(ccf_list, ['int_value', 'real_value', 'bool_value'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0005_customfield_args_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='bool_value',
+            field=models.BooleanField(default=None, null=True, verbose_name='boolean value'),
+        ),
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='int_value',
+            field=models.IntegerField(default=None, null=True, verbose_name='integer value'),
+        ),
+        migrations.AddField(
+            model_name='contactcustomfield',
+            name='real_value',
+            field=models.FloatField(default=None, null=True, verbose_name='real value'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'int_value'], name='contacts_ccf_int_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'real_value'], name='contacts_ccf_real_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['field', 'bool_value'], name='contacts_ccf_bool_value_idx'),
+        ),
+        migrations.RunPython(fill_typed_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Stored display name and type of contacts
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_display_name(apps, schema_editor):
+    abstract_contact = apps.get_model("contacts", "AbstractContact")
+    legal_entity = apps.get_model("contacts", "LegalEntity")
+    individual = apps.get_model("contacts", "Individual")
+    contact_list = []
+    for legal_entity_item in legal_entity.objects.all().only('abstractcontact_ptr_id', 'name'):
+        contact_list.append(abstract_contact(id=legal_entity_item.abstractcontact_ptr_id, display_name=legal_entity_item.name[:200],
+                                             contact_type='contacts.LegalEntity'))
+    for individual_item in individual.objects.all().only('abstractcontact_ptr_id', 'firstname', 'lastname'):
+        contact_list.append(abstract_contact(id=individual_item.abstractcontact_ptr_id,
+                                             display_name=('%s %s' % (individual_item.lastname, individual_item.firstname))[:200],
+                                             contact_type='contacts.Individual'))
+    abstract_contact.objects.bulk_update(contact_list, ['display_name', 'contact_type'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0006_customfield_typed_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abstractcontact',
+            name='contact_type',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='type'),
+        ),
+        migrations.AddField(
+            model_name='abstractcontact',
+            name='display_name',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=200, verbose_name='contact'),
+        ),
+        migrations.AddIndex(
+            model_name='abstractcontact',
+            index=models.Index(fields=['contact_type', 'display_name'], name='contacts_contact_type_idx'),
+        ),
+        migrations.RunPython(fill_display_name, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Accent-insensitive search key of contacts
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+from logging import getLogger
+
+from django.db import migrations, models, transaction
+
+from lucterios.framework.filetools import remove_accent
+
+
+def fill_search_key(apps, schema_editor):
+    abstract_contact = apps.get_model("contacts", "AbstractContact")
+    contact_list = []
+    for contact_item in abstract_contact.objects.all().only('id', 'display_name'):
+        contact_item.search_key = remove_accent(contact_item.display_name).lower()
+        contact_list.append(contact_item)
+    abstract_contact.objects.bulk_update(contact_list, ['search_key'], batch_size=500)
+
+
+FTS_TABLE = 'contacts_search_fts'
+
+TRIGRAM_INDEX = 'contacts_search_key_trgm'
+
+CONTACT_TABLE = 'contacts_abstractcontact'
+
+SQLITE_STATEMENTS = ["CREATE VIRTUAL TABLE IF NOT EXISTS %(fts)s USING fts5(search_key, content='%(table)s', content_rowid='id', tokenize='trigram')",
+                     "CREATE TRIGGER IF NOT EXISTS %(fts)s_ai AFTER INSERT ON %(table)s BEGIN "
+                     "INSERT INTO %(fts)s(rowid, search_key) VALUES (new.id, new.search_key); END",
+                     "CREATE TRIGGER IF NOT EXISTS %(fts)s_ad AFTER DELETE ON %(table)s BEGIN "
+                     "INSERT INTO %(fts)s(%(fts)s, rowid, search_key) VALUES ('delete', old.id, old.search_key); END",
+                     "CREATE TRIGGER IF NOT EXISTS %(fts)s_au AFTER UPDATE OF search_key ON %(table)s BEGIN "
+                     "INSERT INTO %(fts)s(%(fts)s, rowid, search_key) VALUES ('delete', old.id, old.search_key); "
+                     "INSERT INTO %(fts)s(rowid, search_key) VALUES (new.id, new.search_key); END",
+                     "INSERT INTO %(fts)s(%(fts)s) VALUES ('rebuild')"]
+
+POSTGRESQL_STATEMENTS = ["CREATE EXTENSION IF NOT EXISTS pg_trgm",
+                         "CREATE INDEX IF NOT EXISTS %(index)s ON %(table)s USING gin (search_key gin_trgm_ops)"]
+
+
+def install_search_engine(apps, schema_editor):
+    db_connection = schema_editor.connection
+    if db_connection.vendor == 'sqlite':
+        statements = SQLITE_STATEMENTS
+    elif db_connection.vendor == 'postgresql':
+        statements = POSTGRESQL_STATEMENTS
+    else:
+        statements = []
+    try:
+        with transaction.atomic(using=db_connection.alias):
+            with db_connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement % {'fts': FTS_TABLE, 'index': TRIGRAM_INDEX, 'table': CONTACT_TABLE})
+    except Exception:
+        getLogger('lucterios.contacts').warning("search engine not available for %s", db_connection.vendor)
+
+
+def uninstall_search_engine(apps, schema_editor):
+    db_connection = schema_editor.connection
+    with db_connection.cursor() as cursor:
+        if db_connection.vendor == 'sqlite':
+            for trigger_suffix in ('ai', 'ad', 'au'):
+                cursor.execute("DROP TRIGGER IF EXISTS %s_%s" % (FTS_TABLE, trigger_suffix))
+            cursor.execute("DROP TABLE IF EXISTS %s" % FTS_TABLE)
+        elif db_connection.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS %s" % TRIGRAM_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0007_contact_display_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='abstractcontact',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=200, verbose_name='search key'),
+        ),
+        migrations.RunPython(fill_search_key, migrations.RunPython.noop),
+        migrations.RunPython(install_search_engine, uninstall_search_engine),
+    ]
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Blocking keys for duplicate contact detection
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from lucterios.framework.filetools import remove_accent
+
+PHONE_DIGITS = 9
+
+
+def build_keys(search_key, email, tel1, tel2, postal_code, address):
+    keys = set()
+    if search_key.strip() != '':
+        keys.add((0, search_key.strip()[:200]))
+    for email_item in re.split('[;,]', email):
+        if email_item.strip() != '':
+            keys.add((1, email_item.strip().lower()[:200]))
+    for tel in (tel1, tel2):
+        digits = re.sub(r'\D', '', tel)
+        if len(digits) >= 6:
+            keys.add((2, digits[-PHONE_DIGITS:]))
+    street = " ".join(re.findall('[a-z0-9]+', remove_accent(address).lower()))
+    if (postal_code.strip() != '') and (street != ''):
+        keys.add((3, ("%s %s" % (postal_code.strip(), street))[:200]))
+    return keys
+
+
+def fill_blocking_keys(apps, schema_editor):
+    abstract_contact = apps.get_model("contacts", "AbstractContact")
+    blocking_key = apps.get_model("contacts", "ContactBlockingKey")
+    key_list = []
+    for contact_item in abstract_contact.objects.exclude(contact_type='').values('id', 'contact_type', 'search_key', 'email', 'tel1', 'tel2', 'postal_code', 'address'):
+        for kind, value in build_keys(contact_item['search_key'], contact_item['email'], contact_item['tel1'],
+                                      contact_item['tel2'], contact_item['postal_code'], contact_item['address']):
+            key_list.append(blocking_key(contact_id=contact_item['id'], contact_type=contact_item['contact_type'], kind=kind, value=value))
+    blocking_key.objects.bulk_create(key_list, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0008_contact_search_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactBlockingKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contact_type', models.CharField(max_length=100, verbose_name='type')),
+                ('kind', models.IntegerField(choices=[(0, 'name'), (1, 'email'), (2, 'phone'), (3, 'address')], verbose_name='kind')),
+                ('value', models.CharField(max_length=200, verbose_name='value')),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contacts.AbstractContact', verbose_name='contact')),
+            ],
+            options={
+                'verbose_name': 'blocking key',
+                'verbose_name_plural': 'blocking keys',
+                'default_permissions': [],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='contactblockingkey',
+            index=models.Index(fields=['contact_type', 'kind', 'value'], name='contacts_blocking_key_idx'),
+        ),
+        migrations.RunPython(fill_blocking_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name
+'''
+Indexes for e-mail, custom value and member lookups of contacts
+
+@author: Laurent GAY
+@organization: sd-libre.fr
+@contact: info@sd-libre.fr
+@copyright: 2015 sd-libre.fr
+@license: This file is part of Lucterios.
+
+Lucterios is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Lucterios is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0010_contact_page_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='abstractcontact',
+            index=models.Index(fields=['email'], name='contacts_contact_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactcustomfield',
+            index=models.Index(fields=['contact', 'field'], name='contacts_ccf_contact_field_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='responsability',
+            index=models.Index(fields=['legal_entity', 'individual'], name='contacts_resp_members_idx'),
+        ),
+    ]
@@ -23,20 +23,46 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os.path import exists, join, dirname
+from os import listdir, replace, unlink
+from os.path import join, dirname, getmtime
+import codecs
+import gzip
+from shutil import move
+from datetime import datetime
+from time import time
+from collections import OrderedDict, namedtuple, deque
+from bisect import bisect_left, insort
 import logging
+import threading
+import multiprocessing
+import pickle
+import json
+import ast
+import re
 
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
-from django.db import models
+from django.db import models, connection, transaction, DatabaseError
+from django.apps import apps
+from django.db.models import Q, Case, When, Value
+from django.db.models.functions import Lower
+from django.db.models.expressions import RawSQL
+from django.db.models.query import ModelIterable, Prefetch, prefetch_related_objects
+from django.db.models.signals import post_save, post_delete, class_prepared
+from django.core.signals import request_started
+from django.core.exceptions import ValidationError, EmptyResultSet
+from django.core.validators import validate_email
 
 from lucterios.framework.models import LucteriosModel, PrintFieldsPlugIn, get_value_if_choices,\
-    LucteriosVirtualField
-from lucterios.framework.filetools import get_user_path, readimage_to_base64
+    LucteriosVirtualField, LucteriosScheduler
+from lucterios.framework.filetools import get_user_path, readimage_to_base64, remove_accent
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.CORE.models import Parameter
+from lucterios.CORE.parameters import Params
 from lucterios.framework.tools import get_format_value
 from lucterios.framework.auditlog import auditlog
+from lucterios.framework.error import LucteriosException
+from lucterios.contacts.importworker import init_import_worker, validate_import_chunk
 
 
 class CustomField(LucteriosModel):
@@ -90,11 +116,17 @@ class CustomField(LucteriosModel):
         value = "%s %s" % (get_value_if_choices(self.kind, dep_field), params_txt)
         return value.strip()
 
-    def get_args(self):
+    @classmethod
+    def parse_args(cls, args_text):
         default_args = {'min': 0, 'max': 0, 'prec': 0, 'list': [], 'multi': False}
         try:
-            args = eval(self.args)
-        except Exception:
+            args = json.loads(args_text)
+        except ValueError:
+            try:
+                args = ast.literal_eval(args_text)
+            except (ValueError, SyntaxError):
+                args = {}
+        if not isinstance(args, dict):
             args = {}
         for name, val in default_args.items():
             if name not in args.keys():
@@ -102,6 +134,32 @@ class CustomField(LucteriosModel):
         args['list'] = list(args['list'])
         return args
 
+    def get_args(self):
+        if getattr(self, '_args_parsed', None) is None or (self._args_parsed[0] != self.args):
+            self._args_parsed = (self.args, self.parse_args(self.args))
+        return self._args_parsed[1]
+
+    def set_args(self, args):
+        self.args = json.dumps(args, sort_keys=True)
+
+    def convert_value(self, value):
+        try:
+            if self.kind == 1:
+                value = int(value)
+            if self.kind == 2:
+                value = float(value)
+            if self.kind == 3:
+                value = (value != 'False') and (value != '0') and (value != '') and (value != 'n')
+            if self.kind == 4:
+                args_list = self.get_args()['list']
+                if args_list.count(value) > 0:
+                    value = args_list.index(value)
+                else:
+                    value = int(value)
+        except Exception:
+            value = ""
+        return six.text_type(value)
+
     def get_field(self):
         from django.db.models.fields import IntegerField, DecimalField, BooleanField, TextField
         from django.core.validators import MaxValueValidator, MinValueValidator
@@ -130,15 +188,12 @@ class CustomField(LucteriosModel):
 
     @classmethod
     def get_fields(cls, model):
-        fields = []
         import inspect
         model_list = []
         for sub_class in inspect.getmro(model):
             if hasattr(sub_class, "get_long_name"):
                 model_list.append(sub_class.get_long_name())
-        for cf_model in cls.objects.filter(modelname__in=model_list):
-            fields.append((cf_model.get_fieldname(), cf_model))
-        return fields
+        return CustomFieldCache.get_fields(model_list)
 
     @classmethod
     def edit_fields(cls, xfer, init_col):
@@ -165,10 +220,323 @@ class CustomField(LucteriosModel):
         default_permissions = []
 
 
+class CustomFieldCache(object):
+
+    _FIELDS_BY_MODELS = {}
+
+    _FIELD_BY_ID = {}
+
+    _cachelock = threading.RLock()
+
+    @classmethod
+    def clear(cls, *_args, **_kwargs):
+        cls._cachelock.acquire()
+        try:
+            cls._FIELDS_BY_MODELS.clear()
+            cls._FIELD_BY_ID.clear()
+        finally:
+            cls._cachelock.release()
+
+    @classmethod
+    def get_fields(cls, model_list):
+        model_key = tuple(model_list)
+        cls._cachelock.acquire()
+        try:
+            if model_key not in cls._FIELDS_BY_MODELS.keys():
+                fields = []
+                for cf_model in CustomField.objects.filter(modelname__in=model_list):
+                    cls._FIELD_BY_ID[cf_model.id] = cf_model
+                    fields.append((cf_model.get_fieldname(), cf_model))
+                cls._FIELDS_BY_MODELS[model_key] = fields
+            return list(cls._FIELDS_BY_MODELS[model_key])
+        finally:
+            cls._cachelock.release()
+
+    @classmethod
+    def get_field(cls, cf_id):
+        cls._cachelock.acquire()
+        try:
+            if cf_id not in cls._FIELD_BY_ID.keys():
+                cls._FIELD_BY_ID[cf_id] = CustomField.objects.get(id=cf_id)
+            return cls._FIELD_BY_ID[cf_id]
+        finally:
+            cls._cachelock.release()
+
+
+post_save.connect(CustomFieldCache.clear, sender=CustomField, dispatch_uid='customfield_cache_save', weak=False)
+post_delete.connect(CustomFieldCache.clear, sender=CustomField, dispatch_uid='customfield_cache_delete', weak=False)
+request_started.connect(CustomFieldCache.clear, dispatch_uid='customfield_cache_request', weak=False)
+
+
+class ContactImageCache(object):
+
+    MaxSize = 16 * 1024 * 1024
+
+    PrintSize = 300
+
+    Renditions = (('Image', 100), ('Print', PrintSize))
+
+    _IMAGES = OrderedDict()
+
+    _DEFAULT_IMAGE = None
+
+    _size = 0
+
+    _cachelock = threading.RLock()
+
+    _renderlock = threading.Lock()
+
+    @classmethod
+    def clear(cls):
+        with cls._cachelock:
+            cls._IMAGES.clear()
+            cls._size = 0
+
+    @classmethod
+    def discard(cls, img_path):
+        with cls._cachelock:
+            if img_path in cls._IMAGES:
+                cls._size -= len(cls._IMAGES.pop(img_path)[1])
+
+    @classmethod
+    def get_default_image(cls):
+        if cls._DEFAULT_IMAGE is None:
+            cls._DEFAULT_IMAGE = readimage_to_base64(join(dirname(__file__), "static", 'lucterios.contacts', "images", "NoImage.png"))
+        return cls._DEFAULT_IMAGE
+
+    @classmethod
+    def read_image(cls, img_path):
+        try:
+            img_mtime = getmtime(img_path)
+        except OSError:
+            return None
+        with cls._cachelock:
+            if img_path in cls._IMAGES:
+                if cls._IMAGES[img_path][0] == img_mtime:
+                    cls._IMAGES.move_to_end(img_path)
+                    return cls._IMAGES[img_path][1]
+                cls.discard(img_path)
+        img = readimage_to_base64(img_path)
+        with cls._cachelock:
+            if (img_path not in cls._IMAGES) and (len(img) <= cls.MaxSize):
+                cls._IMAGES[img_path] = (img_mtime, img)
+                cls._size += len(img)
+                while cls._size > cls.MaxSize:
+                    cls._size -= len(cls._IMAGES.popitem(last=False)[1][1])
+        return img
+
+    @classmethod
+    def get_contact_image(cls, contact_id, size=0):
+        renditions = sorted(cls.Renditions, key=lambda rendition: rendition[1])
+        # smallest rendition big enough first, then the smaller ones: Image_<id>.jpg also holds photos saved before renditions
+        rendition_names = [rendition_name for rendition_name, rendition_size in renditions if rendition_size >= size]
+        rendition_names += [rendition_name for rendition_name, rendition_size in reversed(renditions) if rendition_size < size]
+        img = None
+        for rendition_name in rendition_names:
+            if img is None:
+                img = cls.read_image(get_user_path("contacts", "%s_%s.jpg" % (rendition_name, contact_id)))
+        if img is None:
+            img = cls.get_default_image()
+        return img
+
+    @classmethod
+    def add_upload(cls, contact_id, upload_file):
+        move(upload_file, get_user_path("contacts", "Upload_%s" % contact_id))
+        LucteriosScheduler.add_date(render_contact_images, datetime.now())
+
+    @classmethod
+    def render_uploads(cls):
+        from lucterios.framework.filetools import open_image_resize
+        with cls._renderlock:
+            upload_dir = dirname(get_user_path("contacts", "Upload_0"))
+            for upload_name in sorted(listdir(upload_dir)):
+                if upload_name[:7] != 'Upload_':
+                    continue
+                contact_id = upload_name[7:]
+                work_path = join(upload_dir, "Render_%s" % contact_id)
+                try:
+                    replace(join(upload_dir, upload_name), work_path)
+                except OSError:
+                    continue
+                try:
+                    for rendition_name, rendition_size in cls.Renditions:
+                        img_path = get_user_path("contacts", "%s_%s.jpg" % (rendition_name, contact_id))
+                        with open(work_path, "rb") as image_tmp:
+                            image = open_image_resize(image_tmp, rendition_size, rendition_size)
+                            image = image.convert("RGB")
+                            with open(img_path + ".tmp", "wb") as image_file:
+                                image.save(image_file, 'JPEG', quality=90)
+                        replace(img_path + ".tmp", img_path)
+                        cls.discard(img_path)
+                except Exception:
+                    logging.getLogger('lucterios.contacts').exception("render_uploads")
+                finally:
+                    unlink(work_path)
+
+
+def render_contact_images():
+    '''Contact images'''
+    ContactImageCache.render_uploads()
+
+
+class ContactSearchMatch(RawSQL):
+
+    def as_sql(self, compiler, connection):
+        # the lookup already wraps its right-hand side in parentheses: "IN ((SELECT ...))" is read as a scalar by SQLite
+        return self.sql, self.params
+
+
+class ContactSearchEngine(object):
+
+    FtsTable = 'contacts_search_fts'
+
+    TrigramIndex = 'contacts_search_key_trgm'
+
+    MinTrigramLength = 3
+
+    _BACKENDS = {}
+
+    _cachelock = threading.RLock()
+
+    @classmethod
+    def clear(cls):
+        with cls._cachelock:
+            cls._BACKENDS.clear()
+
+    @classmethod
+    def get_key(cls, text):
+        return remove_accent(six.text_type(text)).lower()
+
+    @classmethod
+    def _detect_backend(cls):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT count(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                               [cls.FtsTable, cls.FtsTable + '_ai', cls.FtsTable + '_ad', cls.FtsTable + '_au'])
+                if cursor.fetchone()[0] == 4:
+                    return 'fts5'
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = %s", [cls.TrigramIndex])
+                if cursor.fetchone()[0] == 1:
+                    return 'trigram'
+        return 'key'
+
+    @classmethod
+    def get_backend(cls):
+        db_name = connection.settings_dict['NAME']
+        with cls._cachelock:
+            if db_name not in cls._BACKENDS.keys():
+                cls._BACKENDS[db_name] = cls._detect_backend()
+            return cls._BACKENDS[db_name]
+
+    @classmethod
+    def get_filter(cls, text):
+        search_key = cls.get_key(text).strip()
+        if search_key == '':
+            return Q()
+        if (cls.get_backend() == 'fts5') and (len(search_key) >= cls.MinTrigramLength):
+            return Q(pk__in=ContactSearchMatch("SELECT rowid FROM %s WHERE search_key MATCH %%s" % cls.FtsTable,
+                                               ['"%s"' % search_key.replace('"', '""')]))
+        return Q(search_key__contains=search_key)
+
+
+def get_final_children(items, annotation_names=()):
+    final_items = list(items)
+    indexes_by_model = {}
+    for index, item in enumerate(final_items):
+        indexes_by_model.setdefault(item.__class__, []).append(index)
+    while len(indexes_by_model) > 0:
+        parent_model, indexes = indexes_by_model.popitem()
+        for rel_obj in parent_model._meta.related_objects:
+            if rel_obj.one_to_one and rel_obj.parent_link and (len(indexes) > 0):
+                children = rel_obj.related_model._base_manager.in_bulk([final_items[index].pk for index in indexes])
+                parent_indexes = []
+                for index in indexes:
+                    parent_item = final_items[index]
+                    child_item = children.get(parent_item.pk)
+                    rel_obj.set_cached_value(parent_item, child_item)
+                    if child_item is None:
+                        parent_indexes.append(index)
+                    else:
+                        for annotation_name in annotation_names:
+                            setattr(child_item, annotation_name, getattr(parent_item, annotation_name))
+                        final_items[index] = child_item
+                        indexes_by_model.setdefault(child_item.__class__, []).append(index)
+                indexes = parent_indexes
+    return final_items
+
+
+class FinalChildIterable(ModelIterable):
+
+    def __iter__(self):
+        return iter(get_final_children(ModelIterable.__iter__(self), list(self.queryset.query.annotations.keys())))
+
+
+class CustomizeQuerySet(models.QuerySet):
+
+    def with_custom_values(self):
+        return self.prefetch_related(self.model.get_custom_related_name())
+
+    def with_final_children(self):
+        clone = self._chain()
+        clone._iterable_class = FinalChildIterable
+        return clone
+
+    def with_custom_pivot(self, field_names=None):
+        from django.db.models import OuterRef, Subquery
+        pivot_fields = {}
+        for cf_name, cf_model in CustomField.get_fields(self.model):
+            if (field_names is None) or (cf_name in field_names):
+                args = {self.model.FieldName: OuterRef('pk'), 'field_id': cf_model.id}
+                pivot_fields['pivot_' + cf_name] = Subquery(self.model.CustomFieldClass.objects.filter(**args).order_by('id').values('value')[:1])
+        return self.annotate(**pivot_fields)
+
+    def for_print(self, print_text):
+        from django.core.exceptions import FieldDoesNotExist
+        field_paths = set([tuple(field[1:].split('.')) for field in LucteriosModel.TO_EVAL_FIELD.findall(print_text)])
+        lookups = set()
+        for field_path in field_paths:
+            current_model = self.model
+            lookup = []
+            for field_name in field_path:
+                if field_name[-4:] == '_set':
+                    field_name = field_name[:-4]
+                try:
+                    dep_field = current_model._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    break
+                if not dep_field.is_relation or (dep_field.related_model is None):
+                    break
+                if dep_field.auto_created and not dep_field.concrete:
+                    lookup.append(dep_field.get_accessor_name())
+                else:
+                    lookup.append(dep_field.name)
+                current_model = dep_field.related_model
+            if len(lookup) > 0:
+                lookups.add('__'.join(lookup))
+        items = self.with_custom_pivot([field_path[0] for field_path in field_paths])
+        return items.prefetch_related(*sorted(lookups))
+
+
 class CustomizeObject(object):
 
     CustomFieldClass = None
     FieldName = ''
+    CustomBatchSize = 500
+
+    _import_pending = threading.local()
+
+    @classmethod
+    def get_custom_related_name(cls):
+        return cls.CustomFieldClass._meta.get_field(cls.FieldName).remote_field.get_accessor_name()
+
+    def _get_custom_values(self, cf_model):
+        prefetched = self.__dict__.get('_prefetched_objects_cache', {}).get(self.get_custom_related_name())
+        if prefetched is None:
+            args = {self.FieldName: self, 'field': cf_model}
+            return list(self.CustomFieldClass.objects.filter(**args))
+        else:
+            return [ccf_model for ccf_model in prefetched if ccf_model.field_id == cf_model.id]
 
     @classmethod
     def get_fields_to_show(cls):
@@ -186,33 +554,45 @@ class CustomizeObject(object):
         return fields_desc
 
     def set_custom_values(self, params):
-        for cf_name, cf_model in CustomField.get_fields(self.__class__):
-            if cf_name in params.keys():
-                cf_value = params[cf_name]
-                cf_id = int(cf_name[7:])
-                cf_model = CustomField.objects.get(id=cf_id)
-                try:
-                    if cf_model.kind == 1:
-                        cf_value = int(cf_value)
-                    if cf_model.kind == 2:
-                        cf_value = float(cf_value)
-                    if cf_model.kind == 3:
-                        cf_value = (cf_value != 'False') and (cf_value != '0') and (cf_value != '') and (cf_value != 'n')
-                    if cf_model.kind == 4:
-                        args_list = cf_model.get_args()['list']
-                        if args_list.count(cf_value) > 0:
-                            cf_value = args_list.index(cf_value)
-                        else:
-                            cf_value = int(cf_value)
-                except Exception:
-                    cf_value = ""
-                args = {self.FieldName: self, 'field': cf_model}
-                ccf_model = self.CustomFieldClass.objects.get_or_create(**args)
-                ccf_model[0].value = six.text_type(cf_value)
-                ccf_model[0].save()
+        self.save_custom_values([(self, params)], bulk=False)
+
+    @classmethod
+    def save_custom_values(cls, items_params, bulk=True, converted=False):
+        new_values = {}
+        for item, params in items_params:
+            for cf_name, cf_model in CustomField.get_fields(item.__class__):
+                if cf_name in params.keys():
+                    new_values[(item.id, cf_model.id)] = params[cf_name] if converted else cf_model.convert_value(params[cf_name])
+        existing_values = {}
+        contact_ids = sorted(set([item_id for item_id, _field_id in new_values.keys()]))
+        field_ids = sorted(set([field_id for _item_id, field_id in new_values.keys()]))
+        for index in range(0, len(contact_ids), cls.CustomBatchSize):
+            args = {cls.FieldName + '_id__in': contact_ids[index:index + cls.CustomBatchSize], 'field_id__in': field_ids}
+            for ccf_model in cls.CustomFieldClass.objects.filter(**args).order_by('-id'):
+                existing_values[(getattr(ccf_model, cls.FieldName + '_id'), ccf_model.field_id)] = ccf_model
+        ccf_to_update = []
+        ccf_to_create = []
+        for (item_id, field_id), cf_value in sorted(new_values.items()):
+            ccf_model = existing_values.get((item_id, field_id))
+            if ccf_model is None:
+                ccf_model = cls.CustomFieldClass(**{cls.FieldName + '_id': item_id, 'field_id': field_id})
+                ccf_to_create.append(ccf_model)
+            elif ccf_model.value != cf_value:
+                ccf_to_update.append(ccf_model)
+            ccf_model.value = cf_value
+        if bulk:
+            for ccf_model in ccf_to_update + ccf_to_create:
+                ccf_model.set_typed_values()
+            cls.CustomFieldClass.objects.bulk_update(ccf_to_update, ['value'] + cls.CustomFieldClass.get_typed_fieldnames(), batch_size=cls.CustomBatchSize)
+            cls.CustomFieldClass.objects.bulk_create(ccf_to_create, batch_size=cls.CustomBatchSize)
+        else:
+            for ccf_model in ccf_to_update + ccf_to_create:
+                ccf_model.save()
+        for item, _params in items_params:
+            item.__dict__.get('_prefetched_objects_cache', {}).pop(cls.get_custom_related_name(), None)
 
     def get_custom_by_name(self, custom_name):
-        fields = CustomField.objects.filter(modelname=self.__class__.get_long_name(), name=custom_name)
+        fields = [cf_model for _cf_name, cf_model in CustomFieldCache.get_fields([self.__class__.get_long_name()]) if cf_model.name == custom_name]
         if len(fields) == 1:
             return getattr(self, fields[0].get_fieldname())
         else:
@@ -226,7 +606,7 @@ class CustomizeObject(object):
             field_title = ''
         elif name[:7] == "custom_":
             cf_id = int(name[7:])
-            cf_model = CustomField.objects.get(id=cf_id)
+            cf_model = CustomFieldCache.get_field(cf_id)
             field_title = cf_model.name
             if cf_model.kind == 0:
                 format_num = None
@@ -250,21 +630,15 @@ class CustomizeObject(object):
             return six.text_type(self.get_final_child())
         elif name[:7] == "custom_":
             cf_id = int(name[7:])
-            cf_model = CustomField.objects.get(id=cf_id)
-            if self.id is None:
-                ccf_value = ""
-            else:
-                args = {self.FieldName: self, 'field': cf_model}
-                ccf_models = self.CustomFieldClass.objects.filter(**args)
-                if len(ccf_models) == 0:
-                    ccf_model = self.CustomFieldClass.objects.create(**args)
-                elif len(ccf_models) == 1:
-                    ccf_model = ccf_models[0]
-                else:
-                    ccf_model = ccf_models[0]
-                    for old_model in ccf_models[1:]:
-                        old_model.delete()
-                ccf_value = ccf_model.value
+            cf_model = CustomFieldCache.get_field(cf_id)
+            ccf_value = ""
+            if ('pivot_' + name) in self.__dict__:
+                if self.__dict__['pivot_' + name] is not None:
+                    ccf_value = self.__dict__['pivot_' + name]
+            elif self.id is not None:
+                ccf_models = self._get_custom_values(cf_model)
+                if len(ccf_models) > 0:
+                    ccf_value = min(ccf_models, key=lambda ccf_model: ccf_model.id).value
             if cf_model.kind == 0:
                 return six.text_type(ccf_value)
             if ccf_value == '':
@@ -304,6 +678,188 @@ class PostalCode(LucteriosModel):
         unique_together = (('postal_code', 'city', 'country'),)
 
 
+PostalCodeEntry = namedtuple('PostalCodeEntry', ['postal_code', 'city', 'country'])
+
+
+class PostalCodeIndex(object):
+
+    Timeout = 600
+
+    _CODES = []
+
+    _CITIES = []
+
+    _loaded_time = None
+
+    _cachelock = threading.RLock()
+
+    @classmethod
+    def clear(cls, *args, **kwargs):
+        with cls._cachelock:
+            cls._CODES = []
+            cls._CITIES = []
+            cls._loaded_time = None
+
+    @classmethod
+    def get_city_key(cls, city):
+        return remove_accent(six.text_type(city)).lower().strip()
+
+    @classmethod
+    def _load(cls):
+        if (cls._loaded_time is None) or ((time() - cls._loaded_time) > cls.Timeout):
+            codes = []
+            cities = []
+            for postal_code, city, country in PostalCode.objects.order_by().values_list('postal_code', 'city', 'country').iterator():
+                codes.append((postal_code, city, country))
+                cities.append((cls.get_city_key(city), postal_code, city, country))
+            codes.sort()
+            cities.sort()
+            cls._CODES = codes
+            cls._CITIES = cities
+            cls._loaded_time = time()
+
+    @classmethod
+    def _get_prefix_range(cls, sorted_list, prefix):
+        return bisect_left(sorted_list, (prefix,)), bisect_left(sorted_list, (prefix + '\uffff',))
+
+    @classmethod
+    def get_entries(cls, postal_code):
+        postal_code = six.text_type(postal_code).strip()
+        with cls._cachelock:
+            cls._load()
+            first_idx, last_idx = bisect_left(cls._CODES, (postal_code,)), bisect_left(cls._CODES, (postal_code + '\x00',))
+            return [PostalCodeEntry(*item) for item in cls._CODES[first_idx:last_idx]]
+
+    @classmethod
+    def complete_code(cls, prefix, limit=20):
+        with cls._cachelock:
+            cls._load()
+            first_idx, last_idx = cls._get_prefix_range(cls._CODES, six.text_type(prefix).strip())
+            return [PostalCodeEntry(*item) for item in cls._CODES[first_idx:min(last_idx, first_idx + limit)]]
+
+    @classmethod
+    def complete_city(cls, prefix, limit=20):
+        with cls._cachelock:
+            cls._load()
+            first_idx, last_idx = cls._get_prefix_range(cls._CITIES, cls.get_city_key(prefix))
+            return [PostalCodeEntry(*item[1:]) for item in cls._CITIES[first_idx:min(last_idx, first_idx + limit)]]
+
+    @classmethod
+    def get_prefix_filter(cls, prefix):
+        prefix = six.text_type(prefix).strip()
+        if prefix == '':
+            return Q()
+        return Q(postal_code__gte=prefix) & Q(postal_code__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+    @classmethod
+    def saved(cls, sender, instance, created=False, raw=False, **kwargs):
+        with cls._cachelock:
+            if cls._loaded_time is not None:
+                if not created or raw:
+                    cls._loaded_time = None
+                else:
+                    insort(cls._CODES, (instance.postal_code, instance.city, instance.country))
+                    insort(cls._CITIES, (cls.get_city_key(instance.city), instance.postal_code, instance.city, instance.country))
+
+    @classmethod
+    def deleted(cls, sender, instance, **kwargs):
+        with cls._cachelock:
+            if cls._loaded_time is not None:
+                cls._CODES = [item for item in cls._CODES if item != (instance.postal_code, instance.city, instance.country)]
+                cls._CITIES = [item for item in cls._CITIES if item[1:] != (instance.postal_code, instance.city, instance.country)]
+
+
+post_save.connect(PostalCodeIndex.saved, sender=PostalCode, dispatch_uid='postal_code_index_save', weak=False)
+post_delete.connect(PostalCodeIndex.deleted, sender=PostalCode, dispatch_uid='postal_code_index_delete', weak=False)
+
+
+class PostalCodeLoader(object):
+
+    BatchSize = 5000
+
+    FilterSize = 900
+
+    DatasetFiles = ['postalcode_frDOMTOM.csv', 'postalcode_ch.csv', 'postalcode_fr01.csv', 'postalcode_fr02.csv', 'postalcode_fr03.csv',
+                    'postalcode_fr04.csv', 'postalcode_fr05.csv', 'postalcode_fr06.csv', 'postalcode_fr07.csv', 'postalcode_fr08.csv',
+                    'postalcode_fr09.csv', 'postalcode_fr10.csv', 'postalcode_fr11.csv', 'postalcode_fr12.csv', 'postalcode_fr13.csv',
+                    'postalcode_fr14.csv', 'postalcode_be.csv']
+
+    def __init__(self, postalcode_model=None, batch_size=None):
+        self.model = postalcode_model if postalcode_model is not None else PostalCode
+        self.batch_size = batch_size if batch_size is not None else self.BatchSize
+
+    @classmethod
+    def get_dataset_path(cls, file_name):
+        return join(dirname(__file__), 'migrations', file_name)
+
+    @classmethod
+    def read_file(cls, file_name):
+        if file_name.endswith('.gz'):
+            pc_file = codecs.getreader('utf-8')(gzip.open(file_name, 'rb'))
+        else:
+            pc_file = codecs.open(file_name, 'r', 'utf-8')
+        with pc_file:
+            for line in pc_file:
+                values = [six.text_type(value).strip() for value in line.split(';')[:3]]
+                if (len(values) == 3) and (values[0] != '') and (values[1] != '') and (values[2] != ''):
+                    yield tuple(values)
+
+    def _insert_batch(self, batch_keys):
+        postal_codes = sorted(set([postal_code for postal_code, _city, _country in batch_keys]))
+        existing_keys = set()
+        for idx in range(0, len(postal_codes), self.FilterSize):
+            existing_keys.update(self.model.objects.filter(postal_code__in=postal_codes[idx:idx + self.FilterSize]).values_list('postal_code', 'city', 'country'))
+        new_keys = sorted(batch_keys - existing_keys)
+        self.model.objects.bulk_create([self.model(postal_code=postal_code, city=city, country=country)
+                                        for postal_code, city, country in new_keys], batch_size=self.batch_size)
+        return len(new_keys)
+
+    def load_file(self, file_name, country=None, loaded_keys=None):
+        start_time = time()
+        nb_read = 0
+        nb_created = 0
+        batch_keys = set()
+        with transaction.atomic():
+            for pc_key in self.read_file(file_name):
+                if (country is not None) and (pc_key[2] != country):
+                    continue
+                nb_read += 1
+                batch_keys.add(pc_key)
+                if loaded_keys is not None:
+                    loaded_keys.add(pc_key)
+                if len(batch_keys) >= self.batch_size:
+                    nb_created += self._insert_batch(batch_keys)
+                    batch_keys = set()
+            if len(batch_keys) > 0:
+                nb_created += self._insert_batch(batch_keys)
+        duration = time() - start_time
+        logging.getLogger('lucterios.contacts').info("postal codes %s: %d read, %d created in %.2fs", file_name, nb_read, nb_created, duration)
+        return nb_read, nb_created, duration
+
+    def remove_missing(self, country, loaded_keys):
+        nb_deleted = 0
+        old_ids = [pc_id for pc_id, postal_code, city in self.model.objects.filter(country=country).values_list('id', 'postal_code', 'city').iterator()
+                   if (postal_code, city, country) not in loaded_keys]
+        for idx in range(0, len(old_ids), self.FilterSize):
+            nb_deleted += self.model.objects.filter(id__in=old_ids[idx:idx + self.FilterSize]).delete()[0]
+        return nb_deleted
+
+    def load_files(self, file_names, country=None, replace_country=False, progress=None):
+        nb_created = 0
+        nb_deleted = 0
+        loaded_keys = set() if replace_country and (country is not None) else None
+        with transaction.atomic():
+            for file_name in file_names:
+                file_read, file_created, duration = self.load_file(file_name, country, loaded_keys)
+                nb_created += file_created
+                if progress is not None:
+                    progress(file_name, file_read, file_created, duration)
+            if loaded_keys is not None:
+                nb_deleted = self.remove_missing(country, loaded_keys)
+        PostalCodeIndex.clear()
+        return nb_created, nb_deleted
+
+
 class Function(LucteriosModel):
     name = models.CharField(_('name'), max_length=50, unique=True)
 
@@ -342,9 +898,44 @@ class ContactCustomField(LucteriosModel):
     contact = models.ForeignKey('AbstractContact', verbose_name=_('contact'), null=False, on_delete=models.CASCADE)
     field = models.ForeignKey('CustomField', verbose_name=_('field'), null=False, on_delete=models.CASCADE)
     value = models.TextField(_('value'), default="")
+    int_value = models.IntegerField(_('integer value'), null=True, default=None)
+    real_value = models.FloatField(_('real value'), null=True, default=None)
+    bool_value = models.BooleanField(_('boolean value'), null=True, default=None)
 
     data = LucteriosVirtualField(verbose_name=_('value'), compute_from='get_data')
 
+    TypedFieldNames = {1: 'int_value', 2: 'real_value', 3: 'bool_value', 4: 'int_value'}
+
+    @classmethod
+    def get_typed_fieldname(cls, kind):
+        return cls.TypedFieldNames.get(kind, 'value')
+
+    @classmethod
+    def get_typed_fieldnames(cls):
+        return sorted(set(cls.TypedFieldNames.values()))
+
+    def set_typed_values(self):
+        self.int_value = None
+        self.real_value = None
+        self.bool_value = None
+        if self.value != '':
+            kind = CustomFieldCache.get_field(self.field_id).kind
+            try:
+                if kind in (1, 4):
+                    self.int_value = int(self.value)
+                if kind == 2:
+                    self.real_value = float(self.value)
+                if kind == 3:
+                    self.bool_value = (self.value != 'False') and (self.value != '0') and (self.value != 'n')
+            except ValueError:
+                pass
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.set_typed_values()
+        if (update_fields is not None) and ('value' in update_fields):
+            update_fields = list(update_fields) + self.get_typed_fieldnames()
+        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+
     def get_data(self):
         data = None
         if self.field.kind == 0:
@@ -367,10 +958,34 @@ class ContactCustomField(LucteriosModel):
     def get_auditlog_object(self):
         return self.contact.get_final_child()
 
+    @classmethod
+    def remove_duplicates(cls, contact_ids=None):
+        table_name = connection.ops.quote_name(cls._meta.db_table)
+        sql_text = "DELETE FROM %(table)s WHERE %(where)sid NOT IN (SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM %(table)s %(where_group)sGROUP BY contact_id, field_id) AS keep_ids)"
+        if contact_ids is None:
+            sql_where = ''
+            sql_params = []
+        elif len(contact_ids) == 0:
+            return 0
+        else:
+            sql_where = "contact_id IN (%s)" % ",".join(['%s'] * len(contact_ids))
+            sql_params = list(contact_ids) * 2
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql_text % {'table': table_name, 'where': sql_where + ' AND ' if sql_where != '' else '',
+                                           'where_group': 'WHERE ' + sql_where + ' ' if sql_where != '' else ''}, sql_params)
+                return cursor.rowcount
+
     class Meta(object):
         verbose_name = _('custom field value')
         verbose_name_plural = _('custom field values')
         default_permissions = []
+        indexes = [
+            models.Index(fields=['field', 'int_value'], name='contacts_ccf_int_value_idx'),
+            models.Index(fields=['field', 'real_value'], name='contacts_ccf_real_value_idx'),
+            models.Index(fields=['field', 'bool_value'], name='contacts_ccf_bool_value_idx'),
+            models.Index(fields=['contact', 'field'], name='contacts_ccf_contact_field_idx'),
+        ]
 
 
 class AbstractContact(LucteriosModel, CustomizeObject):
@@ -378,6 +993,9 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     CustomFieldClass = ContactCustomField
     FieldName = 'contact'
 
+    MailtoMaxLength = 1800
+    EmailChunkSize = 2000
+
     address = models.TextField(_('address'), blank=False)
     postal_code = models.CharField(_('postal code'), max_length=10, blank=False)
     city = models.CharField(_('city'), max_length=100, blank=False)
@@ -386,13 +1004,43 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     tel2 = models.CharField(_('tel2'), max_length=20, blank=True)
     email = models.EmailField(_('email'), blank=True)
     comment = models.TextField(_('comment'), blank=True)
+    display_name = models.CharField(_('contact'), max_length=200, blank=True, default='', db_index=True)
+    contact_type = models.CharField(_('type'), max_length=100, blank=True, default='')
+    search_key = models.CharField(_('search key'), max_length=200, blank=True, default='', db_index=True)
+
+    objects = CustomizeQuerySet.as_manager()
 
     def __str__(self):
-        if self.get_final_child() != self:
-            return six.text_type(self.get_final_child())
+        final_child = self.get_final_child()
+        if final_child != self:
+            return six.text_type(final_child)
         else:
             return "contact#%d" % self.id
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if self.__class__ is not AbstractContact:
+            self.display_name = six.text_type(self)[:200]
+            self.contact_type = self.get_long_name()
+            self.search_key = ContactSearchEngine.get_key(self.display_name)
+            if update_fields is not None:
+                update_fields = list(update_fields) + ['display_name', 'contact_type', 'search_key']
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if self.__class__ is not AbstractContact:
+            ContactBlockingKey.refresh([self])
+        return res
+
+    def merge_objects(self, alias_objects=[]):
+        if not isinstance(alias_objects, list):
+            alias_objects = [alias_objects]
+        ContactMerger([(self, alias_objects)]).run()
+
+    @classmethod
+    def get_query_for_duplicate(cls):
+        contact_type = None if cls is AbstractContact else cls.get_long_name()
+        sql_text, sql_params = ContactBlockingKey.get_pairs_sql(contact_type)
+        ids_sql = "SELECT candidates.contact1_id FROM (%(pairs)s) candidates UNION SELECT candidates.contact2_id FROM (%(pairs)s) candidates"
+        return Q(pk__in=ContactSearchMatch(ids_sql % {'pairs': sql_text}, sql_params + sql_params))
+
     @classmethod
     def get_field_by_name(cls, fieldname):
         dep_field = CustomizeObject.get_virtualfield(fieldname)
@@ -402,7 +1050,7 @@ class AbstractContact(LucteriosModel, CustomizeObject):
 
     @classmethod
     def get_default_fields(cls):
-        return [(_('contact'), 'str'), 'tel1', 'tel2', 'email']
+        return ['display_name', 'tel1', 'tel2', 'email']
 
     @classmethod
     def get_show_fields(cls):
@@ -417,10 +1065,12 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     @classmethod
     def get_search_fields(cls):
         fieldnames = []
+        if cls is AbstractContact:
+            fieldnames.append('display_name')
         fieldnames.extend(['address', 'postal_code', 'city', 'country', 'tel1', 'tel2', 'email', 'comment'])
         from django.db.models import Q
         for cf_name, cf_model in CustomField.get_fields(cls):
-            fieldnames.append((cf_name, cf_model.get_field(), 'contactcustomfield__value', Q(contactcustomfield__field__id=cf_model.id)))
+            fieldnames.append((cf_name, cf_model.get_field(), 'contactcustomfield__' + ContactCustomField.get_typed_fieldname(cf_model.kind), Q(contactcustomfield__field__id=cf_model.id)))
         return fieldnames
 
     @classmethod
@@ -434,17 +1084,44 @@ class AbstractContact(LucteriosModel, CustomizeObject):
             fields.append((field[0], field[1].name))
         return fields
 
+    @classmethod
+    def initialize_import(cls):
+        cls._import_pending.items = []
+
+    @classmethod
+    def _flush_import_custom_values(cls):
+        pending_items = getattr(cls._import_pending, 'items', [])
+        cls._import_pending.items = []
+        if len(pending_items) > 0:
+            cls.save_custom_values(pending_items)
+
     @classmethod
     def import_data(cls, rowdata, dateformat):
         try:
             new_item = super(AbstractContact, cls).import_data(rowdata, dateformat)
             if new_item is not None:
-                new_item.set_custom_values(rowdata)
+                if not hasattr(cls._import_pending, 'items'):
+                    cls._import_pending.items = []
+                cls._import_pending.items.append((new_item, rowdata))
+                if len(cls._import_pending.items) >= cls.CustomBatchSize:
+                    cls._flush_import_custom_values()
             return new_item
         except Exception:
             logging.getLogger('lucterios.contacts').exception("import_data")
             return None
 
+    @classmethod
+    def finalize_import(cls):
+        try:
+            cls._flush_import_custom_values()
+        except Exception:
+            logging.getLogger('lucterios.contacts').exception("finalize_import")
+        return None
+
+    @classmethod
+    def get_importer(cls, dateformat, progress=None, workers=0):
+        return None
+
     def get_presentation(self):
         return ""
 
@@ -457,6 +1134,60 @@ class AbstractContact(LucteriosModel, CustomizeObject):
             email_list.append(self.email)
         return email_list
 
+    @classmethod
+    def has_bulk_emails(cls):
+        bulk_methods = (AbstractContact.get_email, LegalEntity.get_email)
+        return all([model.get_email in bulk_methods for model in apps.get_models() if issubclass(model, cls)])
+
+    @classmethod
+    def get_emails_by_contact(cls, contacts):
+        emails = {}
+        contact_ids = contacts.order_by().values('id')
+        for contact_id, email in AbstractContact.objects.filter(id__in=contact_ids).values_list('id', 'email'):
+            emails[contact_id] = ([email] if email != '' else [], [])
+        members = set()
+        responsabilities = Responsability.objects.filter(legal_entity_id__in=contact_ids).exclude(individual__email='')
+        for legal_entity_id, individual_id, email in responsabilities.order_by('individual__lastname', 'individual__firstname', 'individual_id').values_list('legal_entity_id', 'individual_id', 'individual__email'):
+            if (legal_entity_id, individual_id) not in members:
+                members.add((legal_entity_id, individual_id))
+                emails[legal_entity_id][1].append(email)
+        return emails
+
+    @classmethod
+    def iter_distinct_emails(cls, contacts):
+        last_key = None
+        email_list = contacts.exclude(email__isnull=True).exclude(email__exact='').annotate(email_key=Lower('email'))
+        for email_key, email in email_list.order_by('email_key').values_list('email_key', 'email').iterator(chunk_size=cls.EmailChunkSize):
+            if email_key != last_key:
+                last_key = email_key
+                yield email
+
+    @classmethod
+    def get_mailto_groups(cls, contacts, max_length=None):
+        if max_length is None:
+            max_length = cls.MailtoMaxLength
+        group = []
+        group_length = 0
+        for email in cls.iter_distinct_emails(contacts):
+            if (len(group) > 0) and ((group_length + len(email)) > max_length):
+                yield group
+                group = []
+                group_length = 0
+            group.append(email)
+            group_length += len(email) + 1
+        if len(group) > 0:
+            yield group
+
+    @classmethod
+    def get_mailto_prefix(cls):
+        mailto_type = Params.getvalue("contacts-mailtoconfig")
+        if mailto_type == 1:  # CC
+            return 'mailto:?cc='
+        elif mailto_type == 2:  # BCC
+            return 'mailto:?bcc='
+        else:  # TO
+            return 'mailto:'
+
     @classmethod
     def get_all_print_fields(cls, with_plugin=True):
         fields = super(AbstractContact, cls).get_all_print_fields(with_plugin)
@@ -466,12 +1197,7 @@ class AbstractContact(LucteriosModel, CustomizeObject):
 
     @property
     def image(self):
-        img_path = get_user_path("contacts", "Image_%s.jpg" % self.abstractcontact_ptr_id)
-        if exists(img_path):
-            img = readimage_to_base64(img_path)
-        else:
-            img = readimage_to_base64(join(dirname(__file__), "static", 'lucterios.contacts', "images", "NoImage.png"))
-        return img.decode('ascii')
+        return ContactImageCache.get_contact_image(self.abstractcontact_ptr_id, ContactImageCache.PrintSize).decode('ascii')
 
     def get_ref_contact(self):
         return self
@@ -479,6 +1205,10 @@ class AbstractContact(LucteriosModel, CustomizeObject):
     class Meta(object):
         verbose_name = _('generic contact')
         verbose_name_plural = _('generic contacts')
+        indexes = [
+            models.Index(fields=['contact_type', 'display_name'], name='contacts_contact_type_idx'),
+            models.Index(fields=['email'], name='contacts_contact_email_idx'),
+        ]
 
 
 class LegalEntity(AbstractContact):
@@ -521,9 +1251,32 @@ class LegalEntity(AbstractContact):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def get_importer(cls, dateformat, progress=None, workers=0):
+        if cls is LegalEntity:
+            return ContactImporter(cls, dateformat, progress, workers)
+        return super(LegalEntity, cls).get_importer(dateformat, progress, workers)
+
+    @classmethod
+    def get_members_prefetch(cls):
+        return Prefetch('responsability_set', queryset=Responsability.objects.select_related('individual').prefetch_related('functions'))
+
+    @classmethod
+    def prefetch_members(cls, legal_entities):
+        legal_entities = [item for item in legal_entities if isinstance(item, LegalEntity)]
+        if len(legal_entities) > 0:
+            prefetch_related_objects(legal_entities, cls.get_members_prefetch())
+
+    def get_members(self):
+        if 'responsability_set' in getattr(self, '_prefetched_objects_cache', {}):
+            members = [resp.individual for resp in self.responsability_set.all()]
+            members.sort(key=lambda indiv: (indiv.lastname, indiv.firstname))
+            return members
+        return list(Individual.objects.filter(responsability__legal_entity=self))
+
     def get_presentation(self):
         sub_contact = []
-        for indiv in Individual.objects.filter(responsability__legal_entity=self):
+        for indiv in self.get_members():
             sub_contact.append(indiv.get_presentation())
         if len(sub_contact) == 0:
             return self.name
@@ -533,8 +1286,10 @@ class LegalEntity(AbstractContact):
     def get_email(self, only_main=None):
         email_list = AbstractContact.get_email(self, only_main)
         if only_main is not True:
-            for indiv in Individual.objects.filter(responsability__legal_entity=self).distinct():
-                if indiv.email != '':
+            members = []
+            for indiv in self.get_members():
+                if (indiv not in members) and (indiv.email != ''):
+                    members.append(indiv)
                     email_list.append(indiv.email)
         return email_list
 
@@ -550,6 +1305,9 @@ class LegalEntity(AbstractContact):
         verbose_name_plural = _('legal entities')
         default_permissions = []
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'abstractcontact_ptr'], name='contacts_legalentity_page_idx'),
+        ]
 
 
 class Individual(AbstractContact):
@@ -588,6 +1346,12 @@ class Individual(AbstractContact):
         return ["image", "firstname", "lastname", 'address', 'postal_code', 'city', 'country', 'tel1', 'tel2',
                 'email', 'comment', 'user', 'responsability_set', 'OUR_DETAIL']
 
+    @classmethod
+    def get_importer(cls, dateformat, progress=None, workers=0):
+        if cls is Individual:
+            return ContactImporter(cls, dateformat, progress, workers)
+        return super(Individual, cls).get_importer(dateformat, progress, workers)
+
     def __str__(self):
         return '%s %s' % (self.lastname, self.firstname)
 
@@ -599,6 +1363,9 @@ class Individual(AbstractContact):
         verbose_name_plural = _('individuals')
         default_permissions = []
         ordering = ['lastname', 'firstname']
+        indexes = [
+            models.Index(fields=['lastname', 'firstname', 'abstractcontact_ptr'], name='contacts_individual_page_idx'),
+        ]
 
 
 class Responsability(LucteriosModel):
@@ -629,9 +1396,696 @@ class Responsability(LucteriosModel):
     def get_print_fields(cls):
         return ["legal_entity", "functions"]
 
+    @classmethod
+    def get_foreignkeys(cls):
+        foreignkeys = []
+        for model in apps.get_models(include_auto_created=True):
+            for field in model._meta.local_fields:
+                if field.many_to_one and (field.related_model is cls):
+                    foreignkeys.append((model, field))
+        return foreignkeys
+
+    @classmethod
+    def _remove_conflicting_links(cls, model, field, main_by_resp):
+        other_fields = [other_field for other_field in model._meta.local_fields if other_field.many_to_one and (other_field is not field)]
+        if len(other_fields) != 1:
+            return
+        other_name = other_fields[0].attname
+        main_links = set(model._base_manager.filter(**{field.attname + '__in': set(main_by_resp.values())}).values_list(field.attname, other_name))
+        conflict_ids = []
+        for link_id, resp_id, other_id in model._base_manager.filter(**{field.attname + '__in': list(main_by_resp.keys())}).order_by('pk').values_list('pk', field.attname, other_name):
+            main_link = (main_by_resp[resp_id], other_id)
+            if main_link in main_links:
+                conflict_ids.append(link_id)
+            else:
+                main_links.add(main_link)
+        model._base_manager.filter(pk__in=conflict_ids).delete()
+
+    @classmethod
+    def _repoint_foreignkeys(cls, main_by_resp):
+        for model, field in cls.get_foreignkeys():
+            if model._meta.auto_created:
+                cls._remove_conflicting_links(model, field, main_by_resp)
+            whens = [When(**{field.attname: resp_id, 'then': Value(main_id)}) for resp_id, main_id in main_by_resp.items()]
+            model._base_manager.filter(**{field.attname + '__in': list(main_by_resp.keys())}).update(**{field.name: Case(*whens, output_field=models.IntegerField())})
+
+    @classmethod
+    def remove_duplicates(cls, contact_ids):
+        resp_by_pair = OrderedDict()
+        query = Q(legal_entity_id__in=contact_ids) | Q(individual_id__in=contact_ids)
+        for resp_id, legal_entity_id, individual_id in cls.objects.filter(query).order_by('id').values_list('id', 'legal_entity_id', 'individual_id'):
+            resp_by_pair.setdefault((legal_entity_id, individual_id), []).append(resp_id)
+        main_by_resp = {}
+        for resp_ids in resp_by_pair.values():
+            for resp_id in resp_ids[1:]:
+                main_by_resp[resp_id] = resp_ids[0]
+        if len(main_by_resp) > 0:
+            cls._repoint_foreignkeys(main_by_resp)
+            cls.objects.filter(id__in=list(main_by_resp.keys())).delete()
+        return len(main_by_resp)
+
     class Meta(object):
         verbose_name = _('associate')
         verbose_name_plural = _('associates')
+        indexes = [
+            models.Index(fields=['legal_entity', 'individual'], name='contacts_resp_members_idx'),
+        ]
+
+
+class ContactBlockingKey(LucteriosModel):
+    contact = models.ForeignKey(AbstractContact, verbose_name=_('contact'), null=False, on_delete=models.CASCADE)
+    contact_type = models.CharField(_('type'), max_length=100, blank=False)
+    kind = models.IntegerField(_('kind'), choices=((0, _('name')), (1, _('email')), (2, _('phone')), (3, _('address'))))
+    value = models.CharField(_('value'), max_length=200, blank=False)
+
+    KindWeights = {0: 40, 1: 30, 2: 20, 3: 10}
+
+    MinScore = 40
+
+    MaxBlockSize = 50
+
+    PhoneDigits = 9
+
+    @classmethod
+    def build_keys(cls, search_key, email, tel1, tel2, postal_code, address):
+        keys = set()
+        if search_key.strip() != '':
+            keys.add((0, search_key.strip()[:200]))
+        for email_item in re.split('[;,]', email):
+            if email_item.strip() != '':
+                keys.add((1, email_item.strip().lower()[:200]))
+        for tel in (tel1, tel2):
+            digits = re.sub(r'\D', '', tel)
+            if len(digits) >= 6:
+                keys.add((2, digits[-cls.PhoneDigits:]))
+        street = " ".join(re.findall('[a-z0-9]+', remove_accent(address).lower()))
+        if (postal_code.strip() != '') and (street != ''):
+            keys.add((3, ("%s %s" % (postal_code.strip(), street))[:200]))
+        return keys
+
+    @classmethod
+    def refresh(cls, contacts):
+        contacts = [contact for contact in contacts if contact.contact_type != '']
+        cls.objects.filter(contact_id__in=[contact.id for contact in contacts]).delete()
+        new_keys = []
+        for contact in contacts:
+            for kind, value in cls.build_keys(contact.search_key, contact.email, contact.tel1, contact.tel2, contact.postal_code, contact.address):
+                new_keys.append(cls(contact_id=contact.id, contact_type=contact.contact_type, kind=kind, value=value))
+        cls.objects.bulk_create(new_keys, batch_size=500)
+
+    @classmethod
+    def get_pairs_sql(cls, contact_type=None):
+        table_name = connection.ops.quote_name(cls._meta.db_table)
+        score_sql = "sum(CASE pairs.kind %s ELSE 0 END)" % " ".join(["WHEN %d THEN %d" % (kind, weight) for kind, weight in cls.KindWeights.items()])
+        sql_params = []
+        sql_text = "SELECT pairs.contact1_id, pairs.contact2_id, %(score)s FROM ("
+        sql_text += "SELECT DISTINCT key1.contact_id AS contact1_id, key2.contact_id AS contact2_id, key1.kind AS kind FROM ("
+        sql_text += "SELECT contact_type, kind, value FROM %(table)s"
+        if contact_type is not None:
+            sql_text += " WHERE contact_type=%%s"
+            sql_params.append(contact_type)
+        sql_text += " GROUP BY contact_type, kind, value HAVING count(*) BETWEEN 2 AND %%s) blocks "
+        sql_params.append(cls.MaxBlockSize)
+        sql_text += "INNER JOIN %(table)s key1 ON key1.contact_type=blocks.contact_type AND key1.kind=blocks.kind AND key1.value=blocks.value "
+        sql_text += "INNER JOIN %(table)s key2 ON key2.contact_type=blocks.contact_type AND key2.kind=blocks.kind AND key2.value=blocks.value AND key2.contact_id>key1.contact_id"
+        sql_text += ") pairs GROUP BY pairs.contact1_id, pairs.contact2_id HAVING %(score)s>=%%s"
+        sql_params.append(cls.MinScore)
+        return sql_text % {'table': table_name, 'score': score_sql}, sql_params
+
+    @classmethod
+    def get_candidates(cls, contact_type=None):
+        sql_text, sql_params = cls.get_pairs_sql(contact_type)
+        candidates = {}
+        with connection.cursor() as cursor:
+            cursor.execute(sql_text, sql_params)
+            for contact1_id, contact2_id, score in cursor.fetchall():
+                candidates[(contact1_id, contact2_id)] = score
+        return candidates
+
+    class Meta(object):
+        verbose_name = _('blocking key')
+        verbose_name_plural = _('blocking keys')
+        default_permissions = []
+        indexes = [
+            models.Index(fields=['contact_type', 'kind', 'value'], name='contacts_blocking_key_idx'),
+        ]
+
+
+class ContactMerger(object):
+
+    BatchSize = 200
+
+    NbSteps = 6
+
+    def __init__(self, merge_groups, progress=None):
+        self.merge_groups = []
+        self.alias_to_main = OrderedDict()
+        for main_contact, alias_contacts in merge_groups:
+            alias_contacts = [alias_contact for alias_contact in alias_contacts if alias_contact.id != main_contact.id]
+            for alias_contact in alias_contacts:
+                if not isinstance(alias_contact, main_contact.__class__):
+                    raise TypeError('Only models of same class can be merged')
+                self.alias_to_main[alias_contact.id] = main_contact.id
+            self.merge_groups.append((main_contact, alias_contacts))
+        self.progress = progress
+        self.step = 0
+
+    def _report(self, text):
+        self.step += 1
+        logging.getLogger('lucterios.contacts').info("merge contacts %d/%d: %s", self.step, self.NbSteps, text)
+        if self.progress is not None:
+            self.progress(self.step, self.NbSteps, text)
+
+    def _get_alias_batches(self):
+        alias_ids = list(self.alias_to_main.keys())
+        for index in range(0, len(alias_ids), self.BatchSize):
+            yield alias_ids[index:index + self.BatchSize]
+
+    def _get_main_value(self, field_name, alias_ids):
+        whens = [When(**{field_name: alias_id, 'then': Value(self.alias_to_main[alias_id])}) for alias_id in alias_ids]
+        return Case(*whens, output_field=models.IntegerField())
+
+    @classmethod
+    def get_contact_models(cls):
+        return [model for model in apps.get_models() if issubclass(model, AbstractContact)]
+
+    @classmethod
+    def get_contact_foreignkeys(cls):
+        contact_models = cls.get_contact_models()
+        foreignkeys = []
+        for model in apps.get_models(include_auto_created=True):
+            if model is ContactBlockingKey:
+                continue
+            for field in model._meta.local_fields:
+                if field.many_to_one and (field.related_model in contact_models):
+                    foreignkeys.append((model, field))
+        return foreignkeys
+
+    def _fill_blank_fields(self):
+        for main_contact, alias_contacts in self.merge_groups:
+            blank_fields = set([field.attname for field in main_contact._meta.local_fields if getattr(main_contact, field.attname) in [None, '']])
+            filled_fields = set()
+            for alias_contact in alias_contacts:
+                for field_name in blank_fields - filled_fields:
+                    field_value = getattr(alias_contact, field_name)
+                    if field_value not in [None, '']:
+                        setattr(main_contact, field_name, field_value)
+                        filled_fields.add(field_name)
+            if len(filled_fields) > 0:
+                main_contact.save(update_fields=[main_contact._meta.get_field(field_name).name for field_name in filled_fields])
+
+    def _remove_conflicting_values(self, alias_ids):
+        main_ids = set([self.alias_to_main[alias_id] for alias_id in alias_ids])
+        main_fields = set(ContactCustomField.objects.filter(contact_id__in=main_ids).values_list('contact_id', 'field_id'))
+        conflict_ids = []
+        for ccf_id, contact_id, field_id in ContactCustomField.objects.filter(contact_id__in=alias_ids).values_list('id', 'contact_id', 'field_id'):
+            if (self.alias_to_main[contact_id], field_id) in main_fields:
+                conflict_ids.append(ccf_id)
+        ContactCustomField.objects.filter(id__in=conflict_ids).delete()
+
+    def _remove_conflicting_links(self, model, field, alias_ids):
+        other_fields = [other_field for other_field in model._meta.local_fields if other_field.many_to_one and (other_field is not field)]
+        if len(other_fields) != 1:
+            return
+        other_name = other_fields[0].attname
+        main_ids = set([self.alias_to_main[alias_id] for alias_id in alias_ids])
+        main_links = set(model._base_manager.filter(**{field.attname + '__in': main_ids}).values_list(field.attname, other_name))
+        conflict_ids = []
+        for link_id, contact_id, other_id in model._base_manager.filter(**{field.attname + '__in': alias_ids}).values_list('pk', field.attname, other_name):
+            main_link = (self.alias_to_main[contact_id], other_id)
+            if main_link in main_links:
+                conflict_ids.append(link_id)
+            else:
+                main_links.add(main_link)
+        model._base_manager.filter(pk__in=conflict_ids).delete()
+
+    def _repoint_foreignkeys(self):
+        foreignkeys = self.get_contact_foreignkeys()
+        for alias_ids in self._get_alias_batches():
+            self._remove_conflicting_values(alias_ids)
+            for model, field in foreignkeys:
+                if model._meta.auto_created:
+                    self._remove_conflicting_links(model, field, alias_ids)
+                model._base_manager.filter(**{field.attname + '__in': alias_ids}).update(**{field.name: self._get_main_value(field.attname, alias_ids)})
+
+    def _repoint_genericfields(self):
+        from django.contrib.contenttypes.fields import GenericForeignKey
+        from django.contrib.contenttypes.models import ContentType
+        alias_ids_by_type = {}
+        for main_contact, alias_contacts in self.merge_groups:
+            for alias_contact in alias_contacts:
+                alias_ids_by_type.setdefault(ContentType.objects.get_for_model(alias_contact), []).append(alias_contact.id)
+        for model in apps.get_models():
+            for generic_field in [field for field in model.__dict__.values() if isinstance(field, GenericForeignKey)]:
+                for content_type, alias_ids in alias_ids_by_type.items():
+                    for index in range(0, len(alias_ids), self.BatchSize):
+                        batch_ids = alias_ids[index:index + self.BatchSize]
+                        model._base_manager.filter(**{generic_field.ct_field: content_type, generic_field.fk_field + '__in': batch_ids}).update(**{generic_field.fk_field: self._get_main_value(generic_field.fk_field, batch_ids)})
+
+    def _remove_duplicates(self):
+        main_ids = sorted(set(self.alias_to_main.values()))
+        for index in range(0, len(main_ids), self.BatchSize):
+            batch_ids = main_ids[index:index + self.BatchSize]
+            Responsability.remove_duplicates(batch_ids)
+            ContactCustomField.remove_duplicates(batch_ids)
+
+    def _delete_aliases(self):
+        for _main_contact, alias_contacts in self.merge_groups:
+            for alias_contact in alias_contacts:
+                alias_contact.delete()
+
+    def run(self):
+        with transaction.atomic():
+            self._fill_blank_fields()
+            self._report('blank fields')
+            self._repoint_foreignkeys()
+            self._report('foreign keys')
+            self._repoint_genericfields()
+            self._report('generic relations')
+            self._remove_duplicates()
+            self._report('duplicates')
+            self._delete_aliases()
+            self._report('aliases')
+            main_contacts = [main_contact for main_contact, _alias_contacts in self.merge_groups]
+            ContactBlockingKey.refresh(main_contacts)
+            for main_contact in main_contacts:
+                Signal.call_signal("post_merge", main_contact)
+            self._report('blocking keys')
+        return len(self.alias_to_main)
+
+
+class ContactRowValidator(object):
+
+    ConvertedTypes = (models.IntegerField, models.FloatField, models.DecimalField, models.DateField, models.TimeField,
+                      models.DateTimeField, models.BooleanField, models.ForeignKey)
+
+    def __init__(self, model, dateformat):
+        self.model = model
+        self.dateformat = dateformat
+        self.fields = {}
+        self.foreign_values = {}
+        for dep_field in model._meta.concrete_fields:
+            self.fields[dep_field.name] = dep_field
+            self.fields[dep_field.attname] = dep_field
+            if isinstance(dep_field, models.ForeignKey) and not dep_field.remote_field.parent_link:
+                foreign_values = {}
+                for sub_item in dep_field.remote_field.model.objects.all():
+                    foreign_values.setdefault(six.text_type(sub_item.get_final_child()), sub_item.pk)
+                self.foreign_values[dep_field.name] = foreign_values
+        self.custom_fields = dict(CustomField.get_fields(model))
+        self.postal_cities = {}
+        for postal_code, city in PostalCode.objects.values_list('postal_code', 'city'):
+            self.postal_cities.setdefault(postal_code, {}).setdefault(PostalCodeIndex.get_city_key(city), city)
+
+    def _convert_value(self, fieldname, fieldvalue, dep_field):
+        if isinstance(dep_field, models.ForeignKey) and not fieldname.endswith('_id'):
+            foreign_value = self.foreign_values[fieldname].get(six.text_type(fieldvalue))
+            if (foreign_value is None) and not dep_field.null:
+                raise ValueError(_("unknown value '%(value)s' for '%(field)s'") % {'value': fieldvalue, 'field': dep_field.verbose_name})
+            return foreign_value
+        for field_type in self.ConvertedTypes:
+            if isinstance(dep_field, field_type):
+                fct = getattr(self.model, "_convert_field_%s" % field_type.__name__.lower(), None)
+                if fct is not None:
+                    return fct(fieldvalue, dep_field=dep_field, dateformat=self.dateformat, fieldname=fieldname)
+        return fieldvalue
+
+    def _check_value(self, dep_field, fieldvalue):
+        if not isinstance(fieldvalue, six.string_types):
+            return
+        max_length = getattr(dep_field, 'max_length', None)
+        if (max_length is not None) and (len(fieldvalue) > max_length):
+            raise ValueError(_("'%(field)s' is longer than %(size)d characters") % {'field': dep_field.verbose_name, 'size': max_length})
+        if isinstance(dep_field, models.EmailField):
+            for email_item in re.split('[;,]', fieldvalue):
+                if email_item.strip() != '':
+                    validate_email(email_item.strip())
+
+    def get_values(self, rowdata):
+        values = {}
+        for fieldname, fieldvalue in rowdata.items():
+            dep_field = self.fields.get(fieldname)
+            if dep_field is None:
+                continue
+            fieldvalue = self._convert_value(fieldname, fieldvalue, dep_field)
+            self._check_value(dep_field, fieldvalue)
+            values[dep_field.attname] = fieldvalue
+        if isinstance(values.get('postal_code'), six.string_types) and isinstance(values.get('city'), six.string_types):
+            cities = self.postal_cities.get(values['postal_code'].strip(), {})
+            values['city'] = cities.get(PostalCodeIndex.get_city_key(values['city']), values['city'])
+        return values
+
+    def get_custom_values(self, rowdata):
+        custom_values = {}
+        for cf_name, cf_model in self.custom_fields.items():
+            if cf_name in rowdata.keys():
+                custom_values[cf_name] = cf_model.convert_value(rowdata[cf_name])
+        return custom_values
+
+    def validate(self, rows):
+        valid_rows = []
+        errors = []
+        for row_num, rowdata in rows:
+            try:
+                valid_rows.append((row_num, self.get_values(rowdata), self.get_custom_values(rowdata)))
+            except ValidationError as err:
+                errors.append((row_num, " ".join([six.text_type(message) for message in err.messages])))
+            except (ValueError, TypeError, LucteriosException) as err:
+                errors.append((row_num, six.text_type(err)))
+        return valid_rows, errors
+
+
+class ContactImporter(object):
+
+    BatchSize = 500
+
+    MaxWorkers = 4
+
+    StartMethod = 'spawn'
+
+    def __init__(self, model, dateformat, progress=None, workers=0):
+        self.model = model
+        self.dateformat = dateformat
+        self.progress = progress
+        self.workers = workers
+        self.nb_rows = 0
+        self.imported_ids = set()
+        self.errors = []
+        self.duration = 0.0
+
+    @classmethod
+    def get_workers(cls):
+        if cls.StartMethod not in multiprocessing.get_all_start_methods():
+            return 0
+        return min(cls.MaxWorkers, multiprocessing.cpu_count())
+
+    @property
+    def rows_per_second(self):
+        if self.duration > 0:
+            return self.nb_rows / self.duration
+        return 0.0
+
+    def _check_required(self, item, values):
+        for fieldname in self.model.get_edit_fields():
+            if isinstance(fieldname, tuple):
+                fieldname = fieldname[1]
+            dep_field = self.model.get_field_by_name(fieldname)
+            if (dep_field is not None) and not dep_field.null and not dep_field.blank:
+                fieldvalue = values[dep_field.attname] if dep_field.attname in values.keys() else getattr(item, dep_field.attname)
+                if fieldvalue in [None, '']:
+                    raise ValueError(_("'%s' is required") % dep_field.verbose_name)
+
+    def _get_key_fields(self, values):
+        key_fields = []
+        for order_fd in self.model._meta.ordering or []:
+            if order_fd[0] == '-':
+                order_fd = order_fd[1:]
+            if order_fd in values.keys():
+                key_fields.append(order_fd)
+        return key_fields
+
+    def _get_key(self, key_fields, values):
+        if (len(key_fields) == 0) or any([values.get(fieldname) is None for fieldname in key_fields]):
+            return None
+        return tuple([six.text_type(values[fieldname]).lower() for fieldname in key_fields])
+
+    def _get_existing_items(self, key_fields, rows):
+        existing_items = {}
+        if len(key_fields) > 0:
+            first_values = set([six.text_type(values[key_fields[0]]) for _row_num, values, _custom_values in rows if values.get(key_fields[0]) is not None])
+            query = Q(import_key__in=[first_value.lower() for first_value in first_values]) | Q(**{key_fields[0] + '__in': first_values})
+            for item in self.model.objects.annotate(import_key=Lower(key_fields[0])).filter(query):
+                existing_items.setdefault(self._get_key(key_fields, item.__dict__), item)
+        return existing_items
+
+    def _reserve_ids(self, nb_ids):
+        table_name = AbstractContact._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT max(id) FROM %s" % connection.ops.quote_name(table_name))
+            last_id = cursor.fetchone()[0] or 0
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name=%s", [table_name])
+                sequence = cursor.fetchone()
+                if sequence is not None:
+                    last_id = max(last_id, sequence[0])
+        return range(last_id + 1, last_id + nb_ids + 1)
+
+    def _insert_items(self, new_items):
+        if len(new_items) == 0:
+            return
+        parent_fields = [field for field in AbstractContact._meta.local_concrete_fields if not field.primary_key]
+        parents = [AbstractContact(**dict([(field.attname, getattr(item, field.attname)) for field in parent_fields])) for item in new_items]
+        if not connection.features.can_return_ids_from_bulk_insert:
+            for parent, parent_id in zip(parents, self._reserve_ids(len(parents))):
+                parent.id = parent_id
+        AbstractContact.objects.bulk_create(parents, batch_size=self.BatchSize)
+        parent_link = self.model._meta.get_ancestor_link(AbstractContact)
+        for item, parent in zip(new_items, parents):
+            setattr(item, parent_link.attname, parent.id)
+            item.id = parent.id
+        child_fields = self.model._meta.local_concrete_fields
+        for index in range(0, len(new_items), self.BatchSize):
+            self.model._base_manager._insert(new_items[index:index + self.BatchSize], fields=child_fields)
+        for item in new_items:
+            item._state.adding = False
+            item._state.db = connection.alias
+
+    def _import_chunk(self, rows):
+        errors = []
+        key_fields = self._get_key_fields(rows[0][1])
+        existing_items = self._get_existing_items(key_fields, rows)
+        chunk_items = {}
+        new_items = []
+        updated_items = []
+        updated_fields = set(['display_name', 'contact_type', 'search_key'])
+        items_params = []
+        for row_num, values, custom_values in rows:
+            key = self._get_key(key_fields, values)
+            item = chunk_items.get(key) if key is not None else None
+            is_queued = item is not None
+            if item is None:
+                item = existing_items.get(key) if key is not None else None
+            if item is None:
+                item = self.model()
+            try:
+                self._check_required(item, values)
+            except ValueError as err:
+                errors.append((row_num, six.text_type(err)))
+                continue
+            for attname, fieldvalue in values.items():
+                setattr(item, attname, fieldvalue)
+            item.display_name = six.text_type(item)[:200]
+            item.contact_type = item.get_long_name()
+            item.search_key = ContactSearchEngine.get_key(item.display_name)
+            if key is not None:
+                chunk_items[key] = item
+            if not is_queued:
+                if item.id is None:
+                    new_items.append(item)
+                else:
+                    updated_items.append(item)
+            if item.id is not None:
+                updated_fields.update([dep_field.name for dep_field in [self.model._meta.get_field(attname) for attname in values.keys()] if not dep_field.primary_key])
+            items_params.append((item, custom_values))
+        self._insert_items(new_items)
+        if len(updated_items) > 0:
+            self.model.objects.bulk_update(updated_items, sorted(updated_fields), batch_size=self.BatchSize)
+        self.model.save_custom_values(items_params, converted=True)
+        ContactBlockingKey.refresh(new_items + updated_items)
+        return set([item.id for item in new_items + updated_items]), errors
+
+    def _flush(self, rows):
+        if len(rows) == 0:
+            return
+        try:
+            with transaction.atomic():
+                item_ids, errors = self._import_chunk(rows)
+        except DatabaseError as err:
+            if len(rows) == 1:
+                item_ids, errors = set(), [(rows[0][0], six.text_type(err))]
+            else:
+                for row in rows:
+                    self._flush([row])
+                return
+        self.imported_ids.update(item_ids)
+        self.errors.extend(errors)
+
+    def _report(self):
+        logging.getLogger('lucterios.contacts').info("import %s: %d rows read, %d imported, %d errors", self.model.get_long_name(), self.nb_rows, len(self.imported_ids), len(self.errors))
+        if self.progress is not None:
+            self.progress(self.nb_rows, len(self.imported_ids), len(self.errors))
+
+    def _get_chunks(self, rows):
+        chunk = []
+        row_num = 0
+        for rowdata in rows:
+            row_num += 1
+            chunk.append((row_num, rowdata))
+            if len(chunk) >= self.BatchSize:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def _validate_chunks(self, validator, chunks):
+        if self.workers < 2:
+            for chunk in chunks:
+                yield validator.validate(chunk)
+            return
+        pool = multiprocessing.get_context(self.StartMethod).Pool(self.workers, initializer=init_import_worker, initargs=(pickle.dumps(validator),))
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(validate_import_chunk, (chunk,)))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def run(self, rows):
+        start_time = time()
+        validator = ContactRowValidator(self.model, self.dateformat)
+        for valid_rows, errors in self._validate_chunks(validator, self._get_chunks(rows)):
+            self.nb_rows += len(valid_rows) + len(errors)
+            self.errors.extend(errors)
+            self._flush(valid_rows)
+            self._report()
+        self.errors.sort()
+        ContactCounterCache.clear()
+        self.duration = time() - start_time
+        return len(self.imported_ids)
+
+
+class KeysetPaging(object):
+
+    @classmethod
+    def encode_cursor(cls, cursor):
+        if cursor is None:
+            return None
+        return json.dumps(cursor, default=six.text_type)
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        try:
+            position, count, key = json.loads(cursor)
+            return int(position), int(count), tuple(key)
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def get_ordering(cls, query_set):
+        if (len(query_set.query.order_by) > 0) or not query_set.query.default_ordering or not query_set.query.can_filter():
+            return None
+        ordering = []
+        for field_name in query_set.model._meta.ordering:
+            if not isinstance(field_name, six.string_types) or ('__' in field_name) or (field_name == '?'):
+                return None
+            ordering.append(field_name)
+        ordering.append('pk')
+        return ordering
+
+    @classmethod
+    def get_after_filter(cls, ordering, cursor):
+        after_filter = Q()
+        for field_idx, field_name in enumerate(ordering):
+            field_filter = {}
+            for previous_idx in range(field_idx):
+                field_filter[ordering[previous_idx].lstrip('-')] = cursor[previous_idx]
+            if field_name.startswith('-'):
+                field_filter[field_name[1:] + '__lt'] = cursor[field_idx]
+            else:
+                field_filter[field_name + '__gt'] = cursor[field_idx]
+            after_filter |= Q(**field_filter)
+        return after_filter
+
+    @classmethod
+    def is_valid_cursor(cls, ordered_set, field_names, record_min, cursor, count):
+        if (cursor is None) or (cursor[0] != (record_min - 1)) or (count is None) or (cursor[1] != count):
+            return False
+        boundary = list(ordered_set.filter(pk=cursor[2][-1]).values_list(*field_names))
+        return [tuple(cursor[2])] == [tuple(item) for item in boundary]
+
+    @classmethod
+    def get_page(cls, query_set, record_min, record_max, cursor=None, count=None):
+        ordering = cls.get_ordering(query_set)
+        if ordering is None:
+            return None, None
+        field_names = [field_name.lstrip('-') for field_name in ordering]
+        ordered_set = query_set.order_by(*ordering)
+        try:
+            if (record_min > 0) and cls.is_valid_cursor(ordered_set, field_names, record_min, cursor, count):
+                page = list(ordered_set.filter(cls.get_after_filter(ordering, cursor[2]))[:record_max - record_min])
+            else:
+                page = list(ordered_set[record_min:record_max])
+        except EmptyResultSet:
+            return [], None
+        next_cursor = None
+        if (count is not None) and (len(page) == (record_max - record_min)) and (record_max < count):
+            next_cursor = (record_max - 1, count, [getattr(page[-1], field_name) for field_name in field_names])
+        return page, next_cursor
+
+
+class ContactCounterCache(object):
+
+    Timeout = 300
+
+    _COUNTS = {}
+
+    _cachelock = threading.RLock()
+
+    @classmethod
+    def clear(cls, *args, **kwargs):
+        with cls._cachelock:
+            cls._COUNTS.clear()
+
+    @classmethod
+    def get_count(cls, model):
+        with cls._cachelock:
+            if model in cls._COUNTS.keys():
+                count_time, count_value = cls._COUNTS[model]
+                if (time() - count_time) < cls.Timeout:
+                    return count_value
+        count_value = model.objects.count()
+        with cls._cachelock:
+            cls._COUNTS[model] = (time(), count_value)
+        return count_value
+
+    @classmethod
+    def adjust(cls, model, delta):
+        with cls._cachelock:
+            if model in cls._COUNTS.keys():
+                count_time, count_value = cls._COUNTS[model]
+                cls._COUNTS[model] = (count_time, max(0, count_value + delta))
+
+    @classmethod
+    def saved(cls, sender, created=False, raw=False, **kwargs):
+        if created and not raw:
+            with cls._cachelock:
+                for model in list(cls._COUNTS.keys()):
+                    if issubclass(sender, model):
+                        cls.adjust(model, 1)
+
+    @classmethod
+    def deleted(cls, sender, **kwargs):
+        cls.adjust(sender, -1)
+
+    @classmethod
+    def connect(cls, model):
+        post_save.connect(cls.saved, sender=model, dispatch_uid='contact_counter_save_%s' % model._meta.label, weak=False)
+        post_delete.connect(cls.deleted, sender=model, dispatch_uid='contact_counter_delete_%s' % model._meta.label, weak=False)
+
+    @classmethod
+    def model_prepared(cls, sender, **kwargs):
+        if issubclass(sender, AbstractContact) and not sender._meta.abstract:
+            cls.connect(sender)
+
+
+for counted_model in (AbstractContact, LegalEntity, Individual, Function, StructureType, CustomField):
+    ContactCounterCache.connect(counted_model)
+class_prepared.connect(ContactCounterCache.model_prepared, dispatch_uid='contact_counter_prepared', weak=False)
 
 
 class OurDetailPrintPlugin(PrintFieldsPlugIn):
@@ -668,8 +2122,8 @@ def contacts_checkparam():
 
 @Signal.decorate('auditlog_register')
 def contacts_auditlog_register():
-    auditlog.register(LegalEntity)
-    auditlog.register(Individual)
+    auditlog.register(LegalEntity, exclude_fields=['display_name', 'contact_type', 'search_key'])
+    auditlog.register(Individual, exclude_fields=['display_name', 'contact_type', 'search_key'])
     auditlog.register(Responsability, include_fields=['individual', 'functions'])
     auditlog.register(PostalCode)
     auditlog.register(Function)
@@ -34,8 +34,8 @@ from lucterios.CORE.models import LucteriosUser
 
 from lucterios.contacts.views import PostalCodeList, PostalCodeAdd, Configuration, CurrentStructure, \
     CurrentStructureAddModify, Account, AccountAddModify, CurrentStructurePrint
-from lucterios.contacts.models import LegalEntity
-from lucterios.contacts.tests_contacts import change_ourdetail, create_jack
+from lucterios.contacts.models import LegalEntity, ContactImageCache, PostalCode, PostalCodeIndex, PostalCodeLoader
+from lucterios.contacts.tests_contacts import change_ourdetail, create_jack, assert_num_queries
 
 
 class PostalCodeTest(LucteriosTest):
@@ -45,6 +45,11 @@ class PostalCodeTest(LucteriosTest):
         ourdetails = LegalEntity.objects.get(id=1)
         ourdetails.postal_code = "97400"
         ourdetails.save()
+        PostalCodeIndex.clear()
+
+    def tearDown(self):
+        PostalCodeIndex.clear()
+        LucteriosTest.tearDown(self)
 
     def test_listall(self):
         self.factory.xfer = PostalCodeList()
@@ -121,6 +126,60 @@ class PostalCodeTest(LucteriosTest):
         self.assert_json_equal('', 'type', '3')
         self.assert_json_equal('', 'text', six.text_type('Cet enregistrement existe déjà!'))
 
+    def test_index(self):
+        self.assertEqual(['BELLE PIERRE', 'LE BRULE', 'ST DENIS', 'ST DENIS CAMELIAS', 'ST DENIS TADAR', 'ST FRANCOIS'],
+                         [entry.city for entry in PostalCodeIndex.get_entries('97400')])
+        self.assertEqual('LA REUNION', PostalCodeIndex.get_entries('97400')[0].country)
+        self.assertEqual([], PostalCodeIndex.get_entries('974'))
+        self.assertEqual(20, len(PostalCodeIndex.complete_code('9741', 50)))
+        self.assertEqual(5, len(PostalCodeIndex.complete_code('9741', 5)))
+        self.assertEqual(333, len(PostalCodeIndex.complete_code('', 1000)))
+        self.assertEqual([('97400', 'ST DENIS'), ('97400', 'ST DENIS CAMELIAS'), ('97490', 'ST DENIS CHAUDRON'), ('97400', 'ST DENIS TADAR')],
+                         [(entry.postal_code, entry.city) for entry in PostalCodeIndex.complete_city('st deni')])
+        self.assertEqual(27, PostalCode.objects.filter(PostalCodeIndex.get_prefix_filter('973')).count())
+
+        self.factory.xfer = PostalCodeAdd()
+        self.calljson('/lucterios.contacts/postalCodeAdd', {'SAVE': 'YES', 'postal_code': '97401', 'city': 'Étang Salé', 'country': 'LA REUNION'}, False)
+        self.assert_observer('core.acknowledge', 'lucterios.contacts', 'postalCodeAdd')
+        self.assertEqual(['Étang Salé'], [entry.city for entry in PostalCodeIndex.get_entries('97401')])
+        self.assertEqual(['Étang Salé'], [entry.city for entry in PostalCodeIndex.complete_city('ETANG')])
+        self.assertEqual(7, len(PostalCodeIndex.complete_code('9740', 50)))
+        PostalCode.objects.get(postal_code='97401').delete()
+        self.assertEqual([], PostalCodeIndex.get_entries('97401'))
+
+    def test_loader(self):
+        import gzip
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        pc_file_name = get_user_path('contacts', 'postalcode_test.csv.gz')
+        with gzip.open(pc_file_name, 'wb') as pc_file:
+            pc_file.write("97400;ST DENIS;LA REUNION\n97401;ÉTANG SALÉ;LA REUNION\n97401;ÉTANG SALÉ;LA REUNION\nbad line\n97402;LES AVIRONS;LA REUNION;\n1000;Lausanne;Suisse;\n".encode('utf-8'))
+        self.assertEqual(['BELLE PIERRE', 'LE BRULE', 'ST DENIS', 'ST DENIS CAMELIAS', 'ST DENIS TADAR', 'ST FRANCOIS'],
+                         [entry.city for entry in PostalCodeIndex.get_entries('97400')])
+        nb_reunion = PostalCode.objects.filter(country='LA REUNION').count()
+        out = six.StringIO()
+        call_command('contacts_load_postalcodes', pc_file_name, batch_size=2, stdout=out)
+        self.assertTrue(out.getvalue().startswith(pc_file_name + ": 5 read, 3 created in "))
+        self.assertEqual("3 postal code(s) created, 0 deleted", out.getvalue().split('\n')[1])
+        self.assertEqual(336, PostalCode.objects.count())
+        self.assertEqual(['ÉTANG SALÉ'], [entry.city for entry in PostalCodeIndex.get_entries('97401')])
+
+        out = six.StringIO()
+        call_command('contacts_load_postalcodes', pc_file_name, stdout=out)
+        self.assertEqual("0 postal code(s) created, 0 deleted", out.getvalue().split('\n')[1])
+        loader = PostalCodeLoader()
+        loader.FilterSize = 2
+        with assert_num_queries(self, 2, '"postal_code" IN ('):
+            self.assertEqual((0, 0), loader.load_files([pc_file_name]))
+
+        with self.assertRaises(CommandError):
+            call_command('contacts_load_postalcodes', pc_file_name, replace=True, stdout=out)
+        out = six.StringIO()
+        call_command('contacts_load_postalcodes', pc_file_name, country='LA REUNION', replace=True, stdout=out)
+        self.assertEqual("0 postal code(s) created, %d deleted" % (nb_reunion - 1), out.getvalue().split('\n')[1])
+        self.assertEqual(['97400', '97401', '97402'], list(PostalCode.objects.filter(country='LA REUNION').values_list('postal_code', flat=True)))
+        self.assertEqual(1, PostalCode.objects.filter(country='Suisse').count())
+
 
 class ConfigurationTest(LucteriosTest):
 
@@ -231,6 +290,7 @@ class ConfigurationTest(LucteriosTest):
         self.calljson('/lucterios.contacts/currentStructureAddModify',
                       {"SAVE": 'YES', "uploadlogo": logo_stream}, False)
         self.assert_observer('core.acknowledge', 'lucterios.contacts', 'currentStructureAddModify')
+        ContactImageCache.render_uploads()
         self.assertTrue(exists(get_user_path('contacts', 'Image_1.jpg')))
 
         self.factory.xfer = CurrentStructure()
@@ -24,27 +24,36 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 from shutil import rmtree
+from os import unlink
 from os.path import join, dirname, exists
 from _io import StringIO
 from base64 import b64decode
+from contextlib import contextmanager
+from unittest.mock import patch
 
 from django.utils import six
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.db.models.deletion import Collector
 
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.filetools import get_user_dir, readimage_to_base64, get_user_path
 from lucterios.framework.xfersearch import get_search_query_from_criteria
 from lucterios.CORE.views_usergroup import UsersEdit
-from lucterios.CORE.views import ObjectMerge
+from lucterios.CORE.views import ObjectMerge, StatusMenu
 
 from lucterios.contacts.views import Configuration, CustomFieldAddModify, ContactImport
-from lucterios.contacts.models import LegalEntity, Individual, StructureType, \
-    Function, Responsability, CustomField, ContactCustomField
+from lucterios.contacts.models import LegalEntity, Individual, AbstractContact, StructureType, \
+    Function, Responsability, CustomField, ContactCustomField, CustomFieldCache, \
+    ContactImageCache, ContactSearchEngine, ContactBlockingKey, ContactMerger, ContactCounterCache, \
+    ContactImporter
 from lucterios.contacts.views_contacts import IndividualList, LegalEntityList, \
     LegalEntityAddModify, IndividualAddModify, IndividualShow, IndividualUserAdd, \
     IndividualUserValid, LegalEntityDel, LegalEntityShow, ResponsabilityAdd, \
     ResponsabilityModify, LegalEntitySearch, IndividualSearch, \
     LegalEntityListing, LegalEntityLabel, IndividualListing, IndividualLabel, \
-    AbstractContactFindDouble, AbstractContactShow
+    AbstractContactFindDouble, AbstractContactShow, IndividualListEmails, IndividualSearchEmails, \
+    LegalEntityListEmails
 
 
 def change_ourdetail():
@@ -75,6 +84,14 @@ def create_jack(empty_user=None, firstname="jack", lastname="MISTER", with_email
     return empty_contact
 
 
+@contextmanager
+def assert_num_queries(test_case, nb_queries, sql_text=None):
+    with CaptureQueriesContext(connection) as ctx:
+        yield ctx
+    queries = [query['sql'] for query in ctx.captured_queries if (sql_text is None) or (sql_text in query['sql'])]
+    test_case.assertEqual(nb_queries, len(queries), "\n".join(queries))
+
+
 class ContactsTest(LucteriosTest):
 
     def setUp(self):
@@ -89,6 +106,15 @@ class ContactsTest(LucteriosTest):
         Function.objects.create(name="Tresorier")
         Function.objects.create(name="Troufion")
         create_jack()
+        CustomFieldCache.clear()
+        ContactImageCache.clear()
+        ContactCounterCache.clear()
+
+    def tearDown(self):
+        CustomFieldCache.clear()
+        ContactImageCache.clear()
+        ContactCounterCache.clear()
+        LucteriosTest.tearDown(self)
 
     def test_individual(self):
         self.factory.xfer = IndividualList()
@@ -140,6 +166,131 @@ class ContactsTest(LucteriosTest):
         self.assert_observer('core.custom', 'lucterios.contacts', 'individualList')
         self.assert_count_equal('individual', 0)
 
+    def test_individual_search_key(self):
+        create_jack(firstname="Hélène", lastname="LEFÈVRE")
+        create_jack(firstname="Zoé", lastname="ÉTIENNE")
+        LegalEntity.objects.create(name="Café de la Gare", address="", postal_code="", city="")
+        self.assertEqual(['cafe de la gare', 'etienne zoe', 'lefevre helene', 'mister jack', 'woldcompany'],
+                         list(AbstractContact.objects.order_by('search_key').values_list('search_key', flat=True)))
+        self.assertEqual('fts5', ContactSearchEngine.get_backend())
+        for backend in ('fts5', 'key'):
+            ContactSearchEngine._BACKENDS[connection.settings_dict['NAME']] = backend
+            for name_filter, nb_individual in (('lefevre', 1), ('Hélène', 1), ('HELENE', 1), ('zo', 1), ('e', 3), ('etienne zoe', 1), ('z"e', 0)):
+                self.factory.xfer = IndividualList()
+                self.calljson('/lucterios.contacts/individualList', {'filter': name_filter}, False)
+                self.assert_observer('core.custom', 'lucterios.contacts', 'individualList')
+                self.assert_count_equal('individual', nb_individual)
+            self.assertEqual(['Café de la Gare'], [item.name for item in LegalEntity.objects.filter(ContactSearchEngine.get_filter('cafe'))])
+        ContactSearchEngine.clear()
+        indiv = Individual.objects.get(firstname="Zoé")
+        indiv.firstname = "Chloé"
+        indiv.save()
+        self.assertEqual(['ÉTIENNE Chloé'], [six.text_type(item) for item in Individual.objects.filter(ContactSearchEngine.get_filter('chloe'))])
+        self.assertEqual(0, Individual.objects.filter(ContactSearchEngine.get_filter('zoe')).count())
+        indiv.delete()
+        self.assertEqual(0, AbstractContact.objects.filter(ContactSearchEngine.get_filter('etienne')).count())
+        create_jack(firstname="Hélène", lastname="DUPONT")
+        self.assertEqual(['DUPONT Hélène', 'LEFÈVRE Hélène'], [six.text_type(item) for item in Individual.objects.filter(ContactSearchEngine.get_filter('helene'))])
+
+    def test_individual_write_all(self):
+        for idx in range(110):
+            create_jack(firstname="mail%03d" % idx, lastname="MAILER")
+        for idx in range(10):
+            create_jack(firstname="MAIL%03d" % idx, lastname="MAILER")
+        self.factory.xfer = IndividualList()
+        self.calljson('/lucterios.contacts/individualList', {'filter': 'jack'}, False)
+        self.assert_observer('core.custom', 'lucterios.contacts', 'individualList')
+        self.assertEqual('LINK', self.json_comp['emailAll']['component'])
+        self.assertEqual('mailto:jack@worldcompany.com', self.json_comp['emailAll']['link'])
+        self.factory.xfer = IndividualList()
+        self.calljson('/lucterios.contacts/individualList', {'filter': 'mailer'}, False)
+        self.assert_observer('core.custom', 'lucterios.contacts', 'individualList')
+        self.assertEqual('BUTTON', self.json_comp['emailAll']['component'])
+
+        self.factory.xfer = IndividualListEmails()
+        self.calljson('/lucterios.contacts/individualListEmails', {'filter': 'mailer'}, False)
+        self.assert_observer('core.custom', 'lucterios.contacts', 'individualListEmails')
+        self.assert_json_equal('LABELFORM', 'nb_emails', 110)
+        self.assertEqual(['emailGroup0', 'emailGroup1'], sorted([comp_name for comp_name in self.json_comp.keys() if comp_name.startswith('emailGroup')]))
+        self.assertTrue(self.json_comp['emailGroup0']['link'].lower().startswith('mailto:mail000@worldcompany.com,mail001@worldcompany.com,'))
+        self.assertEqual('mail109@worldcompany.com', self.json_comp['emailGroup1']['link'].split(',')[-1])
+        self.assertEqual('DOWNLOAD', self.json_comp['emailfile']['component'])
+        self.assertTrue(self.json_comp['emailfile']['filename'].startswith('CORE/download?filename=contacts/emails_'))
+        with open(join(get_user_dir(), self.json_comp['emailfile']['filename'][23:].split('&')[0]), 'r', encoding='utf-8') as email_file:
+            email_list = email_file.read().split()
+        self.assertEqual(["mail%03d@worldcompany.com" % idx for idx in range(110)], [email.lower() for email in email_list])
+        first_file_name = self.json_comp['emailfile']['filename']
+
+        AbstractContact.MailtoMaxLength = 100
+        try:
+            self.factory.xfer = IndividualSearchEmails()
+            self.calljson('/lucterios.contacts/individualSearchEmails', {'CRITERIA': 'lastname||1||MAILER'}, False)
+            self.assert_observer('core.custom', 'lucterios.contacts', 'individualSearchEmails')
+            self.assert_json_equal('LABELFORM', 'nb_emails', 110)
+            self.assertEqual([], [comp_name for comp_name in self.json_comp.keys() if comp_name.startswith('emailGroup')])
+        finally:
+            AbstractContact.MailtoMaxLength = 1800
+        self.factory.xfer = LegalEntityListEmails()
+        self.calljson('/lucterios.contacts/legalEntityListEmails', {'structure_type': '0'}, False)
+        self.assert_observer('core.custom', 'lucterios.contacts', 'legalEntityListEmails')
+        self.assert_json_equal('LABELFORM', 'nb_emails', 1)
+        self.assertEqual('mailto:mr-sylvestre@worldcompany.com', self.json_comp['emailGroup0']['link'])
+        self.assertNotEqual(first_file_name, self.json_comp['emailfile']['filename'])
+        self.assertEqual([4, 4, 2], [len(email_group) for email_group in AbstractContact.get_mailto_groups(Individual.objects.filter(firstname__in=("mail000", "mail001", "mail002", "mail003", "mail004", "mail005", "mail006", "mail007", "mail008", "mail009")), 100)])
+
+    def test_individual_keyset_paging(self):
+        def page_ids(page_num, nb_offset, cursor=None, nb_lines=57):
+            params = {'filter': 'pager', 'GRID_SIZE%individual': 10, 'GRID_PAGE%individual': page_num}
+            if cursor is not None:
+                params['GRID_CURSOR%individual'] = cursor
+            self.factory.xfer = IndividualList()
+            with assert_num_queries(self, nb_offset, ' OFFSET '):
+                self.calljson('/lucterios.contacts/individualList', params, False)
+            self.assert_observer('core.custom', 'lucterios.contacts', 'individualList')
+            self.assert_attrib_equal('individual', 'nb_lines', six.text_type(nb_lines))
+            return [record['id'] for record in self.json_data['individual']], self.json_context.get('GRID_CURSOR%individual')
+
+        def get_expected_ids():
+            return list(Individual.objects.filter(lastname="PAGER").order_by('lastname', 'firstname', 'pk').values_list('pk', flat=True))
+
+        for idx in range(57):
+            create_jack(firstname="page%02d" % ((56 - idx) // 2), lastname="PAGER")
+        expected_ids = get_expected_ids()
+        pager_items = Individual.objects.filter(lastname="PAGER")
+        with assert_num_queries(self, 1):
+            self.assertEqual(len(pager_items), 57)
+            self.assertEqual([item.id for item in pager_items[10:20]], expected_ids[10:20])
+        ids, cursor = page_ids(4, 1)
+        self.assertEqual(expected_ids[40:50], ids)
+        self.assertEqual((expected_ids[50:57], None), page_ids(5, 0, cursor))
+        ids, cursor = page_ids(0, 0)
+        self.assertEqual(expected_ids[0:10], ids)
+        for page_num in range(1, 6):
+            ids, cursor = page_ids(page_num, 0, cursor)
+            self.assertEqual(expected_ids[page_num * 10:page_num * 10 + 10], ids)
+        self.assertEqual(expected_ids[10:20], page_ids(1, 1, cursor)[0])
+
+        ids, cursor = page_ids(2, 1, cursor)
+        create_jack(firstname="page00", lastname="PAGER")
+        expected_ids = get_expected_ids()
+        self.assertEqual(expected_ids[30:40], page_ids(3, 1, cursor, 58)[0])
+        ids, cursor = page_ids(3, 1, None, 58)
+        Individual.objects.filter(id=expected_ids[39]).update(firstname="page99")
+        expected_ids = get_expected_ids()
+        self.assertEqual(expected_ids[40:50], page_ids(4, 1, cursor, 58)[0])
+
+        self.factory.xfer = IndividualSearch()
+        self.calljson('/lucterios.contacts/individualSearch', {'CRITERIA': 'lastname||1||PAGER', 'GRID_SIZE%individual': 10, 'GRID_PAGE%individual': 3}, False)
+        self.assert_observer('core.custom', 'lucterios.contacts', 'individualSearch')
+        self.assert_attrib_equal('individual', 'nb_lines', '58')
+        self.assertEqual(expected_ids[30:40], [record['id'] for record in self.json_data['individual']])
+        cursor = self.json_context['GRID_CURSOR%individual']
+        self.factory.xfer = IndividualSearch()
+        with assert_num_queries(self, 0, ' OFFSET '):
+            self.calljson('/lucterios.contacts/individualSearch', {'CRITERIA': 'lastname||1||PAGER', 'GRID_SIZE%individual': 10, 'GRID_PAGE%individual': 4,
+                                                                   'GRID_CURSOR%individual': cursor}, False)
+        self.assertEqual(expected_ids[40:50], [record['id'] for record in self.json_data['individual']])
+
     def test_individual_image(self):
         self.assertFalse(exists(get_user_path('contacts', 'Image_2.jpg')))
         logo_path = join(dirname(__file__), 'docs', 'en', 'EditIndividual.png')
@@ -155,12 +306,25 @@ class ContactsTest(LucteriosTest):
         self.calljson('/lucterios.contacts/individualAddModify',
                       {"SAVE": 'YES', 'individual': '2', "uploadlogo": logo_stream}, False)
         self.assert_observer('core.acknowledge', 'lucterios.contacts', 'individualAddModify')
+        ContactImageCache.render_uploads()
         self.assertTrue(exists(get_user_path('contacts', 'Image_2.jpg')))
+        self.assertTrue(exists(get_user_path('contacts', 'Print_2.jpg')))
+        self.assertFalse(exists(get_user_path('contacts', 'Upload_2')))
 
         self.factory.xfer = IndividualShow()
         self.calljson('/lucterios.contacts/individualShow', {'individual': '2'}, False)
         self.assert_observer('core.custom', 'lucterios.contacts', 'individualShow')
         self.assert_json_equal('IMAGE', 'logoimg', "data:image/*;base64,", True)
+        img_path = get_user_path('contacts', 'Image_2.jpg')
+        self.assertIs(ContactImageCache.read_image(img_path), ContactImageCache.read_image(img_path))
+        self.assertEqual(readimage_to_base64(get_user_path('contacts', 'Print_2.jpg')).decode('ascii'), Individual.objects.get(id=2).image)
+        self.assertIs(ContactImageCache.get_default_image(), ContactImageCache.get_contact_image(1))
+        self.assertIs(ContactImageCache.read_image(img_path), ContactImageCache.get_contact_image(2))
+        self.assertIs(ContactImageCache.read_image(img_path), ContactImageCache.get_contact_image(2, 100))
+        self.assertIs(ContactImageCache.read_image(get_user_path('contacts', 'Print_2.jpg')), ContactImageCache.get_contact_image(2, 101))
+        self.assertIs(ContactImageCache.read_image(get_user_path('contacts', 'Print_2.jpg')), ContactImageCache.get_contact_image(2, 600))
+        unlink(get_user_path('contacts', 'Print_2.jpg'))
+        self.assertIs(ContactImageCache.read_image(img_path), ContactImageCache.get_contact_image(2, 300))
 
     def test_individual_user(self):
         self.factory.xfer = IndividualShow()
@@ -479,6 +643,61 @@ class ContactsTest(LucteriosTest):
         self.assert_json_equal('', 'responsability/@0/individual', "MISTER jack")
         self.assert_json_equal('', 'responsability/@0/functions', ["Secretaire", "Troufion"])
 
+    def test_counters(self):
+        with assert_num_queries(self, 3, 'SELECT COUNT(*)'):
+            self.assertEqual((1, 1, 4), (ContactCounterCache.get_count(LegalEntity), ContactCounterCache.get_count(Individual), ContactCounterCache.get_count(Function)))
+        jack2 = create_jack(firstname="jack2")
+        LegalEntity.objects.create(name='truc')
+        Function.objects.filter(name="Troufion").delete()
+        with assert_num_queries(self, 0, 'COUNT('):
+            self.assertEqual((2, 2, 3), (ContactCounterCache.get_count(LegalEntity), ContactCounterCache.get_count(Individual), ContactCounterCache.get_count(Function)))
+            self.factory.xfer = StatusMenu()
+            self.calljson('/CORE/statusMenu', {}, False)
+        self.assert_json_equal('LABELFORM', 'lbl_nblegalentities', 'Nombre total de structures morales : 2')
+        self.assert_json_equal('LABELFORM', 'lbl_nbindividuals', 'Nombre total de contacts physiques : 2')
+        self.assertEqual(4, ContactCounterCache.get_count(AbstractContact))
+        create_jack(firstname="jack3")
+        with assert_num_queries(self, 0):
+            self.assertEqual((3, 5), (ContactCounterCache.get_count(Individual), ContactCounterCache.get_count(AbstractContact)))
+        self.assertTrue(Collector(using='default').can_fast_delete(ContactBlockingKey.objects.all()))
+        self.assertEqual([False, False], [Collector(using='default').can_fast_delete(model.objects.all()) for model in (Individual, Function)])
+        Individual.objects.filter(firstname="jack3").delete()
+        jack2.delete()
+        self.assertEqual((1, 3), (ContactCounterCache.get_count(Individual), ContactCounterCache.get_count(AbstractContact)))
+        ContactCounterCache._COUNTS[Individual] = (0, 10)
+        self.assertEqual(1, ContactCounterCache.get_count(Individual))
+
+    def test_legalentity_members_queries(self):
+        def check_show(nb_members):
+            self.factory.xfer = LegalEntityShow()
+            with assert_num_queries(self, 4):
+                self.calljson('/lucterios.contacts/legalEntityShow', {'legal_entity': '1'}, False)
+            self.assert_observer('core.custom', 'lucterios.contacts', 'legalEntityShow')
+            self.assert_attrib_equal('responsability', 'nb_lines', six.text_type(nb_members))
+            self.assert_json_equal('', 'responsability/@0/individual', "MISTER jack000")
+            self.assert_json_equal('', 'responsability/@0/functions', ["President", "Secretaire"])
+
+        def check_presentation():
+            legal_entity = LegalEntity.objects.get(id=1)
+            with assert_num_queries(self, 2):
+                LegalEntity.prefetch_members([legal_entity])
+                presentation = legal_entity.get_presentation()
+            self.assertEqual(LegalEntity.objects.get(id=1).get_presentation(), presentation)
+            self.assertEqual("jack000 MISTER, jack001 MISTER", presentation[:30])
+
+        for idx in range(2):
+            resp = Responsability.objects.create(legal_entity_id=1, individual=create_jack(firstname="jack%03d" % idx))
+            resp.functions.set([1, 2])
+        self.factory.xfer = LegalEntityShow()
+        self.calljson('/lucterios.contacts/legalEntityShow', {'legal_entity': '1'}, False)
+        check_show(2)
+        check_presentation()
+        for idx in range(2, 200):
+            resp = Responsability.objects.create(legal_entity_id=1, individual=create_jack(firstname="jack%03d" % idx))
+            resp.functions.set([1, 2])
+        check_show(200)
+        check_presentation()
+
     def test_legalentity_search(self):
         self.factory.xfer = LegalEntityAddModify()
         self.calljson('/lucterios.contacts/legalEntityAddModify', {"address": 'Avenue de la Paix{[newline]}BP 987',
@@ -792,6 +1011,174 @@ class ContactsTest(LucteriosTest):
         self.assertEqual(" 0 0,0 Non ", indiv_jack.evaluate(print_text[168:252]))
         self.assertEqual("boum! -67 9,9 W a{[br/]}z ", indiv_jack.evaluate(print_text[252:]))
 
+    def test_custom_fields_cache(self):
+        from lucterios.framework.xfercomponents import XferCompGrid
+        self._initial_custom_values()
+        for indiv_idx in range(20):
+            create_jack(firstname="jack%d" % indiv_idx)
+        grid_fields = ['lastname', 'firstname', 'custom_1', 'custom_2', 'custom_3', 'custom_5', 'custom_6']
+        grid = XferCompGrid('individual')
+        grid.set_model(Individual.objects.all(), grid_fields)
+        self.assertEqual(21, len(grid.record_ids))
+        self.assertEqual(5, len(CustomField.get_fields(Individual)))
+        with assert_num_queries(self, 0, 'contacts_customfield'):
+            grid = XferCompGrid('individual')
+            grid.set_model(Individual.objects.all(), grid_fields)
+            self.assertEqual(5, len(CustomField.get_fields(Individual)))
+        self.assertEqual(21, len(grid.record_ids))
+        self.assertEqual(('MISTER', 'jack'), (grid.records[2]['lastname'], grid.records[2]['firstname']))
+
+        CustomField.objects.create(name='ggg', modelname='contacts.Individual', kind=0, args="{}")
+        self.assertEqual(6, len(CustomField.get_fields(Individual)))
+        self.assertEqual('custom_7', CustomField.get_fields(Individual)[-1][0])
+        CustomField.objects.get(id=7).delete()
+        self.assertEqual('custom_6', CustomField.get_fields(Individual)[-1][0])
+
+    def test_custom_fields_prefetch(self):
+        self._initial_custom_values()
+        for indiv_idx in range(10):
+            new_indiv = create_jack(firstname="jack%d" % indiv_idx)
+            new_indiv.set_custom_values({'custom_1': 'val%d' % indiv_idx, 'custom_2': '%d' % indiv_idx, 'custom_3': '1.5', 'custom_5': '2', 'custom_6': ''})
+        Individual.objects.get(id=2).set_custom_values({'custom_1': 'first', 'custom_2': '0', 'custom_3': '0', 'custom_5': '0', 'custom_6': ''})
+        CustomField.get_fields(Individual)
+        with assert_num_queries(self, 1, 'contacts_contactcustomfield'):
+            values = [indiv.evaluate("#custom_1 #custom_2 #custom_5") for indiv in Individual.objects.filter(firstname__startswith='jack').with_custom_values()]
+        self.assertEqual(11, len(values))
+        self.assertEqual(("first 0 U", "val3 3 W"), (values[0], values[4]))
+
+    def test_custom_fields_pivot(self):
+        self._initial_custom_values()
+        for indiv_idx in range(10):
+            new_indiv = create_jack(firstname="jack%d" % indiv_idx)
+            if indiv_idx != 5:
+                new_indiv.set_custom_values({'custom_1': 'val%d' % indiv_idx, 'custom_2': '%d' % indiv_idx, 'custom_3': '1.5', 'custom_5': '2'})
+        CustomField.get_fields(Individual)
+        with assert_num_queries(self, 1):
+            values = [indiv.evaluate("#custom_1 #custom_2 #custom_3 #custom_5") for indiv in Individual.objects.filter(firstname__startswith='jack').with_custom_pivot()]
+        self.assertEqual(11, len(values))
+        self.assertEqual("val3 3 1.5 W", values[4])
+        self.assertEqual(" 0 0.0 U", values[6])
+        self.assertEqual(1.5, Individual.objects.with_custom_pivot().get(id=5).custom_3)
+
+    def test_print_lazy_fields(self):
+        self._initial_custom_values()
+        for indiv_idx in range(10):
+            new_indiv = create_jack(firstname="jack%d" % indiv_idx)
+            new_indiv.set_custom_values({'custom_1': 'val%d' % indiv_idx, 'custom_2': '%d' % indiv_idx})
+            Responsability.objects.create(individual=new_indiv, legal_entity_id=1)
+        CustomField.get_fields(Individual)
+        with assert_num_queries(self, 1) as queries:
+            values = [indiv.evaluate("#firstname #lastname") for indiv in Individual.objects.filter(firstname__startswith='jack').for_print("#firstname #lastname")]
+        self.assertEqual(11, len(values))
+        self.assertEqual("jack3 MISTER", values[4])
+        self.assertFalse('contacts_contactcustomfield' in queries.captured_queries[0]['sql'])
+        with assert_num_queries(self, 3):
+            values = [indiv.evaluate("#custom_2 #responsability_set.legal_entity.name")
+                      for indiv in Individual.objects.filter(firstname__startswith='jack').for_print("#custom_2 #responsability_set.legal_entity.name")]
+        self.assertEqual("3 WoldCompany", values[4])
+
+    def test_final_children(self):
+        for indiv_idx in range(10):
+            create_jack(firstname="jack%d" % indiv_idx)
+        with assert_num_queries(self, 3):
+            contacts = list(AbstractContact.objects.all().order_by('id').with_final_children())
+            contact_names = [six.text_type(contact) for contact in contacts]
+            self.assertEqual(contacts, [contact.get_final_child() for contact in contacts])
+        self.assertEqual(12, len(contacts))
+        self.assertEqual((LegalEntity, Individual, Individual), (contacts[0].__class__, contacts[1].__class__, contacts[2].__class__))
+        self.assertEqual(['WoldCompany', 'MISTER jack', 'MISTER jack0'], contact_names[:3])
+
+    def test_display_name(self):
+        change_ourdetail()
+        self.assertEqual([('WoldCompany', 'contacts.LegalEntity'), ('MISTER jack', 'contacts.Individual')],
+                         list(AbstractContact.objects.order_by('id').values_list('display_name', 'contact_type')))
+        indiv = Individual.objects.get(id=2)
+        indiv.lastname = 'ZORRO'
+        indiv.save(update_fields=['lastname'])
+        create_jack(firstname="albert", lastname="ALPHA")
+        self.assertEqual(['ALPHA albert', 'WoldCompany', 'ZORRO jack'], list(AbstractContact.objects.order_by('display_name').values_list('display_name', flat=True)))
+        self.assertEqual(2, AbstractContact.objects.filter(contact_type='contacts.Individual').count())
+
+    def test_emails_by_contact(self):
+        change_ourdetail()
+        albert = create_jack(firstname="albert", lastname="ALPHA")
+        create_jack(firstname="zoe", lastname="ZULU", with_email=False)
+        legal = LegalEntity.objects.create(name='Truc-Muche', email='')
+        Responsability.objects.create(legal_entity_id=1, individual_id=2)
+        Responsability.objects.create(legal_entity_id=1, individual_id=albert.id)
+        Responsability.objects.create(legal_entity_id=1, individual_id=albert.id)
+        Responsability.objects.create(legal_entity_id=legal.id, individual_id=4)
+        with assert_num_queries(self, 2):
+            emails = AbstractContact.get_emails_by_contact(AbstractContact.objects.all())
+        self.assertEqual({1: (['mr-sylvestre@worldcompany.com'], ['albert@worldcompany.com', 'jack@worldcompany.com']),
+                          2: (['jack@worldcompany.com'], []), 3: (['albert@worldcompany.com'], []),
+                          4: ([], []), legal.id: ([], [])}, emails)
+        for contact in AbstractContact.objects.all():
+            self.assertEqual((contact.get_email(True), contact.get_email(False)), emails[contact.id])
+        with assert_num_queries(self, 2):
+            emails = AbstractContact.get_emails_by_contact(LegalEntity.objects.filter(id=1))
+        self.assertEqual({1: (['mr-sylvestre@worldcompany.com'], ['albert@worldcompany.com', 'jack@worldcompany.com'])}, emails)
+
+        self.assertEqual((True, True, True), (AbstractContact.has_bulk_emails(), LegalEntity.has_bulk_emails(), Individual.has_bulk_emails()))
+        Individual.get_email = lambda contact, only_main=None: []
+        try:
+            self.assertEqual((False, True, False), (AbstractContact.has_bulk_emails(), LegalEntity.has_bulk_emails(), Individual.has_bulk_emails()))
+        finally:
+            del Individual.get_email
+
+    def test_custom_fields_readonly(self):
+        from django.core.management import call_command
+        self._initial_custom_values()
+        indiv_jack = Individual.objects.get(id=2)
+        self.assertEqual(['', 0, 0.0, 0, ''], [indiv_jack.custom_1, indiv_jack.custom_2, indiv_jack.custom_3, indiv_jack.custom_5, indiv_jack.custom_6])
+        self.assertEqual(0, ContactCustomField.objects.all().count())
+
+        ContactCustomField.objects.create(contact_id=2, field_id=2, value='12')
+        ContactCustomField.objects.create(contact_id=2, field_id=2, value='34')
+        ContactCustomField.objects.create(contact_id=2, field_id=2, value='56')
+        ContactCustomField.objects.create(contact_id=2, field_id=1, value='abc')
+        ContactCustomField.objects.create(contact_id=1, field_id=2, value='78')
+        ContactCustomField.objects.create(contact_id=1, field_id=2, value='90')
+        indiv_jack = Individual.objects.get(id=2)
+        self.assertEqual(12, indiv_jack.custom_2)
+        self.assertEqual(6, ContactCustomField.objects.all().count())
+        out = StringIO()
+        call_command('contacts_dedup_customfield', stdout=out)
+        self.assertEqual("3 duplicated custom field value(s) removed", out.getvalue().strip())
+        self.assertEqual(3, ContactCustomField.objects.all().count())
+        self.assertEqual(['abc', '12'], [ccf.value for ccf in ContactCustomField.objects.filter(contact_id=2).order_by('field_id')])
+        self.assertEqual(['78'], [ccf.value for ccf in ContactCustomField.objects.filter(contact_id=1)])
+
+        indiv_jack.set_custom_values({'custom_2': '44'})
+        self.assertEqual(44, Individual.objects.get(id=2).custom_2)
+        self.assertEqual(3, ContactCustomField.objects.all().count())
+
+    def test_custom_fields_batch(self):
+        self._initial_custom_values()
+        indivs = [create_jack(firstname="jack%d" % indiv_idx) for indiv_idx in range(10)]
+        self.assertEqual(5, len(CustomField.get_fields(Individual)))
+        with assert_num_queries(self, 2):
+            Individual.save_custom_values([(indiv, {'custom_1': 'abc', 'custom_2': '%d' % indiv.id, 'custom_5': 'W'}) for indiv in indivs])
+        self.assertEqual(30, ContactCustomField.objects.all().count())
+        indiv = Individual.objects.get(id=indivs[3].id)
+        self.assertEqual(('abc', indiv.id, 2), (indiv.custom_1, indiv.custom_2, indiv.custom_5))
+        Individual.save_custom_values([(indiv, {'custom_2': 'xyz', 'custom_5': 'Z'}) for indiv in indivs])
+        self.assertEqual(30, ContactCustomField.objects.all().count())
+        indiv = Individual.objects.get(id=indivs[3].id)
+        self.assertEqual(('abc', 0, 5), (indiv.custom_1, indiv.custom_2, indiv.custom_5))
+
+    def test_custom_fields_args(self):
+        self._initial_custom_values()
+        cf_model = CustomField.objects.get(id=5)
+        self.assertEqual({'multi': False, 'min': 0, 'max': 0, 'prec': 0, 'list': ['U', 'V', 'W', 'X', 'Y', 'Z']}, cf_model.get_args())
+        self.assertIs(cf_model.get_args(), cf_model.get_args())
+        cf_model.set_args({'list': ['A', 'B']})
+        self.assertEqual('{"list": ["A", "B"]}', cf_model.args)
+        self.assertEqual(['A', 'B'], cf_model.get_args()['list'])
+        self.assertEqual(0, cf_model.get_args()['max'])
+        cf_model.args = "os.system('ls')"
+        self.assertEqual([], cf_model.get_args()['list'])
+
     def test_custom_fields_search(self):
         from django.db.models import Q
         self._initial_custom_values()
@@ -823,6 +1210,60 @@ class ContactsTest(LucteriosTest):
         find_indiv = list(Individual.objects.filter(q_res))
         self.assertEqual(1, len(find_indiv), find_indiv)
 
+    def test_custom_fields_typed_search(self):
+        self._initial_custom_values()
+        for indiv_idx in range(5):
+            indiv = create_jack(firstname="jack%d" % indiv_idx)
+            indiv.set_custom_values({'custom_2': '%d' % (indiv_idx * 25), 'custom_3': '%.1f' % (indiv_idx - 2.5), 'custom_5': 'X'})
+        self.assertEqual(([0, 25, 50, 75, 100], [-2.5, -1.5, -0.5, 0.5, 1.5]),
+                         (list(ContactCustomField.objects.filter(field_id=2).order_by('int_value').values_list('int_value', flat=True)),
+                          list(ContactCustomField.objects.filter(field_id=3).order_by('real_value').values_list('real_value', flat=True))))
+        self.assertEqual(5, ContactCustomField.objects.filter(field_id=5, int_value=3).count())
+
+        filter_result, _desc_result = get_search_query_from_criteria("custom_2||3||30", Individual)
+        self.assertEqual(2, Individual.objects.filter(filter_result).count())
+        filter_result, _desc_result = get_search_query_from_criteria("custom_3||4||-1.0", Individual)
+        self.assertEqual(3, Individual.objects.filter(filter_result).count())
+
+    def test_duplicate_blocking_keys(self):
+        self.assertEqual({(0, 'mister jack'), (1, 'jack@worldcompany.com'), (2, '278451295'), (3, '97250 rue de la liberte')},
+                         set(ContactBlockingKey.objects.filter(contact_id=2).values_list('kind', 'value')))
+        self.assertEqual({(0, 'dupond marie'), (1, 'marie@truc.org'), (1, 'mdupond@truc.org'), (2, '123456789')},
+                         ContactBlockingKey.build_keys('dupond marie', 'Marie@truc.org; mdupond@truc.org', '+33 1 23 45 67 89', '01.23.45.67.89', '', 'rue'))
+        self.assertEqual({}, ContactBlockingKey.get_candidates())
+
+        other_jack = create_jack(firstname="Jack")
+        other_jack.email = ''
+        other_jack.save()
+        self.assertEqual({(2, other_jack.id): 70}, ContactBlockingKey.get_candidates('contacts.Individual'))
+        self.assertEqual({}, ContactBlockingKey.get_candidates('contacts.LegalEntity'))
+        homonym = create_jack(firstname="Jâck", lastname="MIStÉR")
+        homonym.tel2 = ''
+        homonym.address = "avenue du port"
+        homonym.email = ''
+        homonym.save()
+        self.assertEqual({(2, other_jack.id): 70, (2, homonym.id): 40, (other_jack.id, homonym.id): 40}, ContactBlockingKey.get_candidates())
+        homonym.firstname = "john"
+        homonym.save()
+        self.assertEqual({(2, other_jack.id): 70}, ContactBlockingKey.get_candidates())
+        self.assertEqual([2, other_jack.id], list(Individual.objects.filter(Individual.get_query_for_duplicate()).order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual([], list(LegalEntity.objects.filter(LegalEntity.get_query_for_duplicate()).values_list('pk', flat=True)))
+
+        pair_ids = [2, other_jack.id]
+        for idx in range(3):
+            first = create_jack(firstname="twin%d" % idx, lastname="TWIN")
+            second = create_jack(firstname="twin%d" % idx, lastname="TWIN", with_email=False)
+            pair_ids.extend([first.id, second.id])
+        self.assertEqual(4, len(ContactBlockingKey.get_candidates('contacts.Individual')))
+        self.assertEqual(pair_ids, list(Individual.objects.filter(Individual.get_query_for_duplicate()).order_by('pk').values_list('pk', flat=True)))
+        Individual.objects.filter(lastname="TWIN").delete()
+
+        for idx in range(ContactBlockingKey.MaxBlockSize):
+            create_jack(firstname="jack%d" % idx)
+        self.assertEqual({(2, other_jack.id): 40}, ContactBlockingKey.get_candidates())
+        other_jack.delete()
+        self.assertEqual({}, ContactBlockingKey.get_candidates())
+
     def test_duplicate_merge(self):
         self._initial_custom_values()
         self.factory.xfer = AbstractContactFindDouble()
@@ -948,6 +1389,67 @@ class ContactsTest(LucteriosTest):
         self.assert_json_equal('', 'responsability/@2/individual', "Dalton Ma'a")
         self.assert_json_equal('', 'responsability/@2/functions', ['Secretaire'])
 
+    def test_merge_batch(self):
+        self._initial_custom_values()
+        entity = LegalEntity.objects.create(name='entity')
+        merge_groups = []
+        for idx in range(20):
+            main_indiv = create_jack(firstname="jack%d" % idx)
+            main_indiv.set_custom_values({'custom_2': '%d' % idx})
+            alias_indiv = create_jack(firstname="jack%d" % idx, with_email=False)
+            alias_indiv.set_custom_values({'custom_2': '99', 'custom_1': 'alias%d' % idx})
+            resp = Responsability.objects.create(legal_entity=entity, individual=main_indiv)
+            resp.functions.set([1])
+            resp = Responsability.objects.create(legal_entity=entity, individual=alias_indiv)
+            resp.functions.set([1, 2])
+            merge_groups.append((main_indiv, [alias_indiv]))
+        self.assertEqual(20, len(ContactBlockingKey.get_candidates()))
+        progress = []
+        self.assertEqual(20, ContactMerger(merge_groups, lambda step, nb_step, text: progress.append((step, nb_step))).run())
+        self.assertEqual([(step, 6) for step in range(1, 7)], progress)
+
+        self.assertEqual(21, Individual.objects.count())
+        self.assertEqual(20, Responsability.objects.filter(legal_entity=entity).count())
+        for idx, (main_indiv, _alias_indivs) in enumerate(merge_groups):
+            indiv = Individual.objects.get(id=main_indiv.id)
+            self.assertEqual(('jack%d@worldcompany.com' % idx, [1, 2], idx, 'alias%d' % idx),
+                             (indiv.email, list(indiv.responsability_set.get().functions.order_by('id').values_list('id', flat=True)), indiv.custom_2, indiv.custom_1))
+        self.assertEqual(40, ContactCustomField.objects.filter(contact__in=[main_indiv for main_indiv, _alias_indivs in merge_groups]).count())
+        self.assertEqual({}, ContactBlockingKey.get_candidates())
+
+        main_indiv = create_jack(firstname="")
+        alias_indiv = create_jack(firstname="bobby", with_email=False)
+        self.assertEqual(1, ContactMerger([(main_indiv, [alias_indiv])]).run())
+        indiv = Individual.objects.get(id=main_indiv.id)
+        self.assertEqual(('bobby', six.text_type(indiv), ContactSearchEngine.get_key(six.text_type(indiv))),
+                         (indiv.firstname, indiv.display_name, indiv.search_key))
+        self.assertEqual([indiv.search_key], list(ContactBlockingKey.objects.filter(contact_id=indiv.id, kind=0).values_list('value', flat=True)))
+
+    def test_merge_delete_aliases(self):
+        entity = LegalEntity.objects.create(name='entity')
+        main_indiv = create_jack(firstname="main")
+        alias_indiv = create_jack(firstname="alias", with_email=False)
+        main_resp = Responsability.objects.create(legal_entity=entity, individual=main_indiv)
+        main_resp.functions.set([1])
+        alias_resp = Responsability.objects.create(legal_entity=entity, individual=alias_indiv)
+        alias_resp.functions.set([1, 2])
+        deleted_ids = []
+        individual_delete = Individual.delete
+
+        def delete_individual(contact, *args, **kwargs):
+            deleted_ids.append(contact.id)
+            return individual_delete(contact, *args, **kwargs)
+        with patch.object(Individual, 'delete', delete_individual):
+            self.assertEqual(1, ContactMerger([(main_indiv, [alias_indiv])]).run())
+        self.assertEqual([alias_indiv.id], deleted_ids)
+        self.assertFalse(Individual.objects.filter(id=alias_indiv.id).exists())
+
+        function_through = Responsability.functions.through
+        self.assertIn((function_through, function_through._meta.get_field('responsability')), Responsability.get_foreignkeys())
+        self.assertEqual([main_resp.id], list(Responsability.objects.filter(legal_entity=entity).values_list('id', flat=True)))
+        self.assertEqual([(main_resp.id, 1), (main_resp.id, 2)],
+                         list(function_through.objects.filter(responsability__legal_entity=entity).order_by('function_id').values_list('responsability_id', 'function_id')))
+
     def test_import_contacts(self):
         csv_content = """value;nom;adresse;codePostal;ville;fixe;portable;mail;Num;Type
 4.6;USIF;37 avenue de la plage;99673;TOUINTOUIN;0502851031;0439423854;pierre572@free.fr;1000029;Type B
@@ -1036,3 +1538,63 @@ class ContactsTest(LucteriosTest):
         self.factory.xfer = LegalEntityList()
         self.calljson('/lucterios.contacts/legalEntityList', {"structure_type": 2}, False)
         self.assert_count_equal('legal_entity', 2)
+
+    def test_import_batched(self):
+        self._initial_custom_values()
+        rows = [{'lastname': 'DUPOND', 'firstname': 'Jean', 'genre': 'Homme', 'address': '1 rue haute', 'postal_code': '99000', 'city': 'ICI', 'custom_2': '12'},
+                {'lastname': 'DURANT', 'firstname': 'Marie', 'genre': 'Femme', 'address': '', 'postal_code': '99000', 'city': 'ICI', 'custom_2': '5'},
+                {'lastname': 'mister', 'firstname': 'JACK', 'genre': 'Homme', 'address': 'rue de la liberté', 'postal_code': '97250', 'city': 'LE PRECHEUR', 'custom_2': '7'},
+                {'lastname': 'LEGRAND', 'firstname': 'Paul', 'genre': 'Homme', 'address': '3 rue basse', 'postal_code': '99000', 'city': 'ICI' * 50, 'custom_2': '1'},
+                {'lastname': 'dupond', 'firstname': 'jean', 'genre': 'Homme', 'address': '2 rue haute', 'postal_code': '99000', 'city': 'LA', 'custom_2': '15'}]
+        progress = []
+        self.assertEqual(AbstractContact.get_importer('%d/%m/%Y'), None)
+        importer = Individual.get_importer('%d/%m/%Y', progress=lambda *args: progress.append(args))
+        self.assertIsInstance(importer, ContactImporter)
+        importer.BatchSize = 3
+        self.assertEqual(importer.run(rows), 2)
+        self.assertEqual(importer.nb_rows, 5)
+        self.assertEqual([row_num for row_num, _error in importer.errors], [2, 4])
+        self.assertEqual(progress, [(3, 2, 1), (5, 2, 2)])
+
+        self.assertEqual(Individual.objects.count(), 2)
+        jack = Individual.objects.get(id=2)
+        self.assertEqual(jack.lastname, 'mister')
+        self.assertEqual(jack.display_name, 'mister JACK')
+        self.assertEqual(jack.custom_2, 7)
+        jean = Individual.objects.get(lastname='dupond')
+        self.assertEqual(jean.address, '2 rue haute')
+        self.assertEqual(jean.city, 'LA')
+        self.assertEqual(jean.genre, 1)
+        self.assertEqual(jean.contact_type, 'contacts.Individual')
+        self.assertEqual(jean.search_key, ContactSearchEngine.get_key('dupond jean'))
+        self.assertEqual(jean.custom_2, 15)
+        self.assertEqual(ContactCustomField.objects.filter(contact=jean, field_id=2).count(), 1)
+        self.assertEqual(set(ContactBlockingKey.objects.filter(contact=jean).values_list('kind', flat=True)), set([0, 3]))
+
+    def test_import_bulk_insert(self):
+        rows = [{'lastname': 'NAME%d' % row_idx, 'firstname': 'Jean', 'genre': 'Homme', 'address': '%d rue haute' % row_idx, 'postal_code': '99000', 'city': 'ICI'} for row_idx in range(7)]
+        importer = Individual.get_importer('%d/%m/%Y')
+        with assert_num_queries(self, 1, 'INSERT INTO "contacts_abstractcontact"'):
+            with assert_num_queries(self, 1, 'INSERT INTO "contacts_individual"'):
+                self.assertEqual(importer.run(rows), 7)
+        self.assertEqual(list(Individual.objects.filter(lastname__startswith='NAME').order_by('id').values_list('id', flat=True)), [3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(Individual.objects.get(lastname='NAME4').address, '4 rue haute')
+        new_contact = Individual.objects.create(lastname='AFTER', firstname='import', genre=1, address='rue', postal_code='99000', city='ICI')
+        self.assertEqual(new_contact.id, 10)
+
+    def test_import_parallel(self):
+        self._initial_custom_values()
+        StructureType.objects.create(name="Type D")
+        rows = []
+        for row_idx in range(20):
+            rows.append({'name': 'STRUCT%02d' % row_idx, 'structure_type': 'Type %s' % ('ABCDE'[row_idx % 5]), 'address': '%d rue haute' % row_idx,
+                         'postal_code': '99000', 'city': 'ICI', 'email': 'struct%d@free.fr' % row_idx if row_idx != 7 else 'bad mail', 'custom_4': 'oui'})
+        importer = LegalEntity.get_importer('%d/%m/%Y', workers=2)
+        importer.BatchSize = 3
+        self.assertEqual(importer.run(rows), 19)
+        self.assertEqual(importer.nb_rows, 20)
+        self.assertEqual([row_num for row_num, _error in importer.errors], [8])
+        self.assertEqual(list(LegalEntity.objects.filter(name__startswith='STRUCT').values_list('name', flat=True)[:3]), ['STRUCT00', 'STRUCT01', 'STRUCT02'])
+        self.assertEqual(LegalEntity.objects.get(name='STRUCT03').structure_type.name, 'Type D')
+        self.assertEqual(LegalEntity.objects.get(name='STRUCT03').custom_4, True)
+        self.assertEqual(LegalEntity.objects.get(name='STRUCT04').structure_type, None)
@@ -44,6 +44,11 @@ class ContactSelection(XferSavedCriteriaSearchEditor):
     select_class = None
     final_class = None
 
+    def filter_items(self):
+        XferSavedCriteriaSearchEditor.filter_items(self)
+        if self.model is AbstractContact:
+            self.items = self.items.order_by('display_name')
+
     def fillresponse(self):
         self.action_list = []
         if self.final_class is not None:
@@ -23,23 +23,22 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from os.path import exists
 
 from django.conf import settings
+from django.apps import apps
 from django.utils.translation import ugettext_lazy as _
 from django.utils import six
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
 from django.db import IntegrityError, transaction
 
 from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, FORMTYPE_REFRESH, CLOSE_NO, WrapAction, ActionsManage, \
     FORMTYPE_MODAL, get_icon_path, SELECT_SINGLE, CLOSE_YES, SELECT_MULTI
 from lucterios.framework.xfergraphic import XferContainerCustom, XferContainerAcknowledge
 from lucterios.framework.xferadvance import XferDelete, XferAddEditor, XferListEditor, TITLE_DELETE, TITLE_ADD, TITLE_MODIFY, TEXT_TOTAL_NUMBER
-from lucterios.framework.xfercomponents import XferCompImage, XferCompLabelForm, XferCompEdit, XferCompGrid, XferCompButton, XferCompCaptcha
+from lucterios.framework.xfercomponents import XferCompImage, XferCompLabelForm, XferCompEdit, XferCompGrid, XferCompButton, XferCompCaptcha, XferCompCheck
 from lucterios.framework import signal_and_lock
 from lucterios.framework.error import LucteriosException, IMPORTANT
-from lucterios.framework.filetools import get_user_path, readimage_to_base64
+from lucterios.framework.filetools import get_user_path
 
 from lucterios.CORE.models import LucteriosUser
 from lucterios.CORE.views_usergroup import UsersEdit
@@ -47,7 +46,8 @@ from lucterios.CORE.views import ParamEdit, ObjectImport
 from lucterios.CORE.xferprint import XferPrintAction
 from lucterios.CORE.parameters import Params, notfree_mode_connect
 
-from lucterios.contacts.models import PostalCode, Function, StructureType, LegalEntity, Individual, CustomField, AbstractContact, Responsability
+from lucterios.contacts.models import PostalCode, Function, StructureType, LegalEntity, Individual, CustomField, AbstractContact, Responsability, \
+    ContactImageCache, ContactCounterCache, PostalCodeIndex, ContactImporter
 from lucterios.contacts.views_contacts import LegalEntityAddModify, LegalEntityShow
 
 
@@ -86,12 +86,12 @@ class Account(XferContainerCustom):
         self.fill_from_model(1, 1, True, fields[_('001@Identity')])
         self.get_components('name').colspan = 2
         self.get_components('structure_type').colspan = 2
-        img_path = get_user_path(
-            "contacts", "Image_%s.jpg" % legal_entity.abstractcontact_ptr_id)
+        img_value = ContactImageCache.read_image(get_user_path(
+            "contacts", "Image_%s.jpg" % legal_entity.abstractcontact_ptr_id))
         img = XferCompImage('logoimg')
-        if exists(img_path):
+        if img_value is not None:
             img.type = 'jpg'
-            img.set_value(readimage_to_base64(img_path))
+            img.set_value(img_value)
         else:
             img.set_value(
                 get_icon_path("lucterios.contacts/images/NoImage.png"))
@@ -434,7 +434,7 @@ class PostalCodeList(XferListEditor):
         comp.set_location(1, 1)
         comp.description = _('Filtrer by postal code')
         self.add_component(comp)
-        self.filter = Q(postal_code__startswith=filter_postal_code)
+        self.filter = PostalCodeIndex.get_prefix_filter(filter_postal_code)
 
 
 @ActionsManage.affect_grid(TITLE_ADD, "images/add.png")
@@ -452,9 +452,66 @@ class ContactImport(ObjectImport):
     caption = _("Contact import")
     icon = "contactsConfig.png"
 
+    MaxErrorsShown = 100
+
+    ParallelMinRows = 5000
+
     def get_select_models(self):
         return AbstractContact.get_select_contact_type(False)
 
+    def _show_import_result(self, importer):
+        lbl = XferCompLabelForm('result')
+        lbl.set_value_as_header(_("%d items are been imported") % len(importer.imported_ids))
+        lbl.set_location(1, 2, 2)
+        self.add_component(lbl)
+        if len(importer.errors) > 0:
+            lbl = XferCompLabelForm('nb_errors')
+            lbl.set_value(_("%(nb)d rows rejected (%(speed).0f rows/s)") % {'nb': len(importer.errors), 'speed': importer.rows_per_second})
+            lbl.set_location(1, 3, 2)
+            self.add_component(lbl)
+            grid = XferCompGrid('import_errors')
+            grid.add_header('row', _('row'))
+            grid.add_header('error', _('error'))
+            for row_num, error in importer.errors[:self.MaxErrorsShown]:
+                grid.set_value(row_num, 'row', row_num)
+                grid.set_value(row_num, 'error', error)
+            grid.set_location(1, 4, 2)
+            self.add_component(grid)
+
+    def _add_parallel_check(self):
+        grid = self.get_components('CSV')
+        if (grid is not None) and (len(grid.record_ids) >= self.ParallelMinRows) and (ContactImporter.get_workers() > 1) and \
+                (self.model.get_importer(self.dateformat) is not None):
+            check = XferCompCheck('parallel')
+            check.set_value(True)
+            check.description = _('parallel validation')
+            check.set_location(1, 3, 2)
+            self.add_component(check)
+
+    def fillresponse(self, modelname, quotechar="'", delimiter=";", encoding="utf-8", dateformat="%d/%m/%Y", step=0, parallel=False):
+        importer = None
+        if step == 3:
+            model = apps.get_model(modelname) if modelname is not None else self.model
+            importer = model.get_importer(dateformat, workers=ContactImporter.get_workers() if parallel else 0)
+        if importer is None:
+            ObjectImport.fillresponse(self, modelname, quotechar, delimiter, encoding, dateformat, step)
+            if step == 2:
+                self._add_parallel_check()
+            return
+        self.model = importer.model
+        self.quotechar = quotechar
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.dateformat = dateformat
+        img = XferCompImage('img')
+        img.set_value(self.icon_path())
+        img.set_location(0, 0, 1, 6)
+        self.add_component(img)
+        _fields_description, csv_readed = self._read_csv_and_convert()
+        importer.run(csv_readed)
+        self._show_import_result(importer)
+        self.add_action(WrapAction(_("Close"), "images/close.png"))
+
 
 @signal_and_lock.Signal.decorate('config')
 def config_contacts(setting_list):
@@ -492,15 +549,15 @@ def conf_wizard_contacts(wizard_ident, xfer):
         xfer.add_component(btn)
         lbl = XferCompLabelForm("nb_function")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Function._meta.verbose_name_plural, 'count': len(Function.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Function._meta.verbose_name_plural, 'count': ContactCounterCache.get_count(Function)})
         xfer.add_component(lbl)
         lbl = XferCompLabelForm("nb_structuretype")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': StructureType._meta.verbose_name_plural, 'count': len(StructureType.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': StructureType._meta.verbose_name_plural, 'count': ContactCounterCache.get_count(StructureType)})
         xfer.add_component(lbl)
         lbl = XferCompLabelForm("nb_customfield")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': CustomField._meta.verbose_name_plural, 'count': len(CustomField.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': CustomField._meta.verbose_name_plural, 'count': ContactCounterCache.get_count(CustomField)})
         xfer.add_component(lbl)
         btn = XferCompButton("btnconf")
         btn.set_location(4, xfer.get_max_row() - 2, 1, 3)
@@ -509,11 +566,11 @@ def conf_wizard_contacts(wizard_ident, xfer):
 
         lbl = XferCompLabelForm("nb_legalentity")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': LegalEntity._meta.verbose_name_plural, 'count': len(LegalEntity.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': LegalEntity._meta.verbose_name_plural, 'count': ContactCounterCache.get_count(LegalEntity)})
         xfer.add_component(lbl)
         lbl = XferCompLabelForm("nb_individual")
         lbl.set_location(1, xfer.get_max_row() + 1)
-        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Individual._meta.verbose_name_plural, 'count': len(Individual.objects.all())})
+        lbl.set_value(TEXT_TOTAL_NUMBER % {'name': Individual._meta.verbose_name_plural, 'count': ContactCounterCache.get_count(Individual)})
         xfer.add_component(lbl)
         btn = XferCompButton("btnimport")
         btn.set_location(4, xfer.get_max_row() - 1, 1, 2)
@@ -23,6 +23,10 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+from os import listdir, unlink
+from os.path import join, dirname, getmtime
+from time import time
+from uuid import uuid4
 
 from django.utils.translation import ugettext_lazy as _
 from django.utils import six
@@ -36,7 +40,8 @@ from lucterios.framework.xferadvance import XferAddEditor, XferDelete, XferShowE
     TITLE_ADD, TITLE_MODIFY, TITLE_EDIT, TITLE_PRINT, TITLE_DELETE, TITLE_LABEL,\
     TITLE_LISTING, TITLE_CREATE
 from lucterios.framework.xfercomponents import XferCompLabelForm, XferCompEdit, XferCompImage, XferCompGrid,\
-    XferCompButton
+    XferCompButton, XferCompLinkLabel, XferCompDownLoad
+from lucterios.framework.filetools import get_user_path
 from lucterios.framework.xfersearch import XferSearchEditor
 from lucterios.framework import signal_and_lock
 
@@ -45,7 +50,8 @@ from lucterios.CORE.models import LucteriosUser
 from lucterios.CORE.xferprint import XferPrintAction, XferPrintListing, XferPrintLabel
 from lucterios.CORE.views import ObjectMerge, ObjectPromote
 
-from lucterios.contacts.models import LegalEntity, Individual, Responsability, AbstractContact
+from lucterios.contacts.models import LegalEntity, Individual, Responsability, AbstractContact,\
+    ContactSearchEngine, ContactCounterCache, KeysetPaging
 from lucterios.CORE.parameters import Params
 
 MenuManage.add_sub("office", None, "lucterios.contacts/images/office.png", _("Office"), _("Office tools"), 70)
@@ -77,6 +83,7 @@ class LegalEntityShow(XferShowEditor):
         if self.getparam(self.field_id, 0) == 0:
             self.params[self.field_id] = self.getparam('legalentity', '0')
         XferShowEditor._search_model(self)
+        LegalEntity.prefetch_members([self.item])
 
 
 @ActionsManage.affect_show(TITLE_PRINT, "images/print.png")
@@ -98,8 +105,134 @@ class LegalEntityDel(XferDelete):
     field_id = 'legal_entity'
 
 
+class KeysetPagingItems(object):
+
+    def __init__(self, query_set, cursor=None, nb_items=None):
+        self.query_set = query_set
+        self.model = query_set.model
+        self.cursor = cursor
+        self.nb_items = nb_items
+        self.next_cursor = None
+
+    def __len__(self):
+        if self.nb_items is None:
+            self.nb_items = self.query_set.count()
+        return self.nb_items
+
+    def __getitem__(self, k):
+        if isinstance(k, slice) and (k.step is None) and (k.start is not None) and (k.start >= 0) and (k.stop is not None) and (k.stop > k.start):
+            page, self.next_cursor = KeysetPaging.get_page(self.query_set, k.start, k.stop, self.cursor, self.nb_items)
+            if page is not None:
+                return page
+        return self.query_set[k]
+
+    def order_by(self, *field_names):
+        return KeysetPagingItems(self.query_set.order_by(*field_names), nb_items=self.nb_items)
+
+
+class KeysetPagingGrid(object):
+
+    def get_cursor_name(self):
+        return 'GRID_CURSOR%' + self.field_id
+
+    def get_keyset_items(self, items):
+        self.keyset_items = KeysetPagingItems(items, KeysetPaging.decode_cursor(self.getparam(self.get_cursor_name())))
+        return self.keyset_items
+
+    def fill_grid(self, row, model, field_id, items):
+        super(KeysetPagingGrid, self).fill_grid(row, model, field_id, self.get_keyset_items(items))
+
+    def save_keyset_cursor(self):
+        cursor = KeysetPaging.encode_cursor(self.keyset_items.next_cursor)
+        if cursor is None:
+            self.params.pop(self.get_cursor_name(), None)
+        else:
+            self.params[self.get_cursor_name()] = cursor
+
+
+class ContactEmailsWriter(object):
+    MaxMailtoGroups = 20
+
+    FileLifetime = 3600
+
+    def get_email_contacts(self):
+        return self.model.objects.none()
+
+    def purge_email_files(self, file_dir):
+        for file_name in listdir(file_dir):
+            if file_name.startswith('emails_') and file_name.endswith('.txt'):
+                try:
+                    if (time() - getmtime(join(file_dir, file_name))) > self.FileLifetime:
+                        unlink(join(file_dir, file_name))
+                except OSError:
+                    pass
+
+    def fillresponse(self):
+        img = XferCompImage('img')
+        img.set_value(self.icon_path())
+        img.set_location(0, 0, 1, 3)
+        self.add_component(img)
+        lbl = XferCompLabelForm('title')
+        lbl.set_value_as_title(_('Write to all'))
+        lbl.set_location(1, 0, 2)
+        self.add_component(lbl)
+        mailto_prefix = AbstractContact.get_mailto_prefix()
+        mailto_groups = []
+        nb_emails = 0
+        file_name = "emails_%s.txt" % uuid4().hex
+        file_path = get_user_path("contacts", file_name)
+        self.purge_email_files(dirname(file_path))
+        with open(file_path, 'w', encoding='utf-8') as email_file:
+            for email_group in AbstractContact.get_mailto_groups(self.get_email_contacts()):
+                email_file.write("\n".join(email_group) + "\n")
+                nb_emails += len(email_group)
+                if mailto_groups is not None:
+                    if len(mailto_groups) < self.MaxMailtoGroups:
+                        mailto_groups.append((nb_emails - len(email_group) + 1, nb_emails, mailto_prefix + ','.join(email_group)))
+                    else:
+                        mailto_groups = None
+        lbl = XferCompLabelForm('nb_emails')
+        lbl.set_value(nb_emails)
+        lbl.set_location(1, 1, 2)
+        lbl.description = _('number of e-mails')
+        self.add_component(lbl)
+        if mailto_groups is not None:
+            for group_idx, (first_email, last_email, mailto_link) in enumerate(mailto_groups):
+                link = XferCompLinkLabel('emailGroup%d' % group_idx)
+                link.set_value_center(_('Write to e-mails %(first)d to %(last)d') % {'first': first_email, 'last': last_email})
+                link.set_link(mailto_link)
+                link.set_location(1, 2 + group_idx, 2)
+                self.add_component(link)
+        emaildown = XferCompDownLoad('emailfile')
+        emaildown.compress = False
+        emaildown.http_file = True
+        emaildown.maxsize = 0
+        emaildown.set_value("emails.txt")
+        emaildown.set_download("contacts/" + file_name)
+        emaildown.set_location(1, self.get_max_row() + 1, 2)
+        self.add_component(emaildown)
+        self.add_action(WrapAction(_('Close'), 'images/close.png'))
+
+
+class ContactListEmails(ContactEmailsWriter):
+
+    def get_email_contacts(self):
+        self.read_filter()
+        return self.get_items_from_filter()
+
+
+class ContactSearchEmails(ContactEmailsWriter):
+
+    def get_email_contacts(self):
+        self.fields_desc.initial(self.item)
+        self.read_criteria_from_params()
+        self.get_text_search()
+        self.filter_items()
+        return self.keyset_items.query_set
+
+
 @MenuManage.describ('contacts.change_abstractcontact', FORMTYPE_NOMODAL, 'contact.actions', _('Management of a structure or organization of people (company, association, administration, ...)'))
-class LegalEntityList(XferListEditor):
+class LegalEntityList(KeysetPagingGrid, XferListEditor):
     caption = _("Legal entities")
     icon = "legalEntity.png"
     model = LegalEntity
@@ -113,13 +246,23 @@ class LegalEntityList(XferListEditor):
         self.fill_from_model(0, 2, False, ['structure_type'])
         obj_strtype = self.get_components('structure_type')
         obj_strtype.set_action(self.request, self.get_action(), modal=FORMTYPE_REFRESH, close=CLOSE_NO)
+        self.read_filter()
+
+    def read_filter(self):
         structure_type = self.getparam('structure_type')
         if (structure_type is not None) and (structure_type != '0'):
             self.filter = Q(structure_type=int(structure_type))
 
     def fillresponse(self):
         XferListEditor.fillresponse(self)
-        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 2)
+        self.save_keyset_cursor()
+        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 2,
+                                            LegalEntityListEmails.get_action(_("Write to all"), "images/show.png"))
+
+
+@MenuManage.describ('contacts.change_abstractcontact')
+class LegalEntityListEmails(ContactListEmails, LegalEntityList):
+    caption = _("Write to all")
 
 
 @ActionsManage.affect_list(TITLE_LISTING, "images/print.png")
@@ -130,6 +273,14 @@ class LegalEntityListing(XferPrintListing):
     model = LegalEntity
     field_id = 'legal_entity'
 
+    def get_report_generator(self):
+        gen = XferPrintListing.get_report_generator(self)
+        self.print_text = " ".join([column[2] for column in gen.columns])
+        return gen
+
+    def filter_callback(self, items):
+        return items.for_print(self.print_text)
+
     def get_filter(self):
         structure_type = self.getparam('structure_type')
         if (structure_type is not None) and (structure_type != '0'):
@@ -146,6 +297,14 @@ class LegalEntityLabel(XferPrintLabel):
     model = LegalEntity
     field_id = 'legal_entity'
 
+    def get_report_generator(self):
+        gen = XferPrintLabel.get_report_generator(self)
+        self.print_text = gen.label_text
+        return gen
+
+    def filter_callback(self, items):
+        return items.for_print(self.print_text)
+
     def get_filter(self):
         structure_type = self.getparam('structure_type')
         if (structure_type is not None) and (structure_type != '0'):
@@ -207,7 +366,7 @@ class IndividualDel(XferDelete):
 
 
 @MenuManage.describ('contacts.change_abstractcontact', FORMTYPE_NOMODAL, 'contact.actions', _('Management of men and women registered'))
-class IndividualList(XferListEditor):
+class IndividualList(KeysetPagingGrid, XferListEditor):
     caption = _("Individuals")
     icon = "individual.png"
     model = Individual
@@ -218,23 +377,30 @@ class IndividualList(XferListEditor):
         self.size_by_page = Params.getvalue("contacts-size-page")
 
     def fillresponse_header(self):
-        name_filter = self.getparam('filter')
-        if name_filter is None:
-            name_filter = ""
         comp = XferCompEdit('filter')
-        comp.set_value(name_filter)
+        comp.set_value(self.getparam('filter', ''))
         comp.set_action(self.request, self.get_action(), modal=FORMTYPE_REFRESH, close=CLOSE_NO)
         comp.set_location(0, 2)
         comp.is_default = True
         comp.description = _('Filtrer by name')
         self.add_component(comp)
+        self.read_filter()
+
+    def read_filter(self):
+        name_filter = self.getparam('filter', '')
         if name_filter != "":
-            self.filter = Q(firstname__icontains=name_filter) | Q(
-                lastname__icontains=name_filter)
+            self.filter = ContactSearchEngine.get_filter(name_filter)
 
     def fillresponse(self):
         XferListEditor.fillresponse(self)
-        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 2)
+        self.save_keyset_cursor()
+        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 2,
+                                            IndividualListEmails.get_action(_("Write to all"), "images/show.png"))
+
+
+@MenuManage.describ('contacts.change_abstractcontact')
+class IndividualListEmails(ContactListEmails, IndividualList):
+    caption = _("Write to all")
 
 
 @ActionsManage.affect_list(TITLE_LABEL, "images/print.png")
@@ -245,10 +411,18 @@ class IndividualLabel(XferPrintLabel):
     model = Individual
     field_id = 'individual'
 
+    def get_report_generator(self):
+        gen = XferPrintLabel.get_report_generator(self)
+        self.print_text = gen.label_text
+        return gen
+
+    def filter_callback(self, items):
+        return items.for_print(self.print_text)
+
     def get_filter(self):
         name_filter = self.getparam('filter')
         if (name_filter is not None) and (name_filter != ""):
-            return [Q(firstname__icontains=name_filter) | Q(lastname__icontains=name_filter)]
+            return [ContactSearchEngine.get_filter(name_filter)]
         else:
             return XferPrintLabel.get_filter(self)
 
@@ -262,10 +436,18 @@ class IndividualListing(XferPrintListing):
     field_id = 'individual'
     with_text_export = True
 
+    def get_report_generator(self):
+        gen = XferPrintListing.get_report_generator(self)
+        self.print_text = " ".join([column[2] for column in gen.columns])
+        return gen
+
+    def filter_callback(self, items):
+        return items.for_print(self.print_text)
+
     def get_filter(self):
         name_filter = self.getparam('filter')
         if (name_filter is not None) and (name_filter != ""):
-            return Q(firstname__icontains=name_filter) | Q(lastname__icontains=name_filter)
+            return ContactSearchEngine.get_filter(name_filter)
         else:
             return XferPrintListing.get_filter(self)
 
@@ -328,7 +510,7 @@ class ResponsabilityAdd(XferContainerCustom):
         self.add_component(comp)
         identfilter = []
         if name_filter != "":
-            identfilter = [Q(firstname__icontains=name_filter) | Q(lastname__icontains=name_filter)]
+            identfilter = [ContactSearchEngine.get_filter(name_filter)]
         items = Individual.objects.filter(*identfilter).distinct()
         grid = XferCompGrid('individual')
         grid.set_model(items, None, self)
@@ -362,7 +544,7 @@ class ResponsabilityDel(XferDelete):
 
 
 @MenuManage.describ('contacts.change_abstractcontact', FORMTYPE_NOMODAL, 'contact.actions', _('To find an individual following a set of criteria.'))
-class IndividualSearch(XferSavedCriteriaSearchEditor):
+class IndividualSearch(KeysetPagingGrid, XferSavedCriteriaSearchEditor):
     caption = _("Individual search")
     icon = "individualFind.png"
     model = Individual
@@ -372,9 +554,16 @@ class IndividualSearch(XferSavedCriteriaSearchEditor):
         XferSavedCriteriaSearchEditor.__init__(self, **kwargs)
         self.size_by_page = Params.getvalue("contacts-size-page")
 
+    def filter_items(self):
+        XferSavedCriteriaSearchEditor.filter_items(self)
+        self.items = self.get_keyset_items(self.items)
+
     def fillresponse(self):
         XferSearchEditor.fillresponse(self)
-        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 5)
+        self.items = self.keyset_items.query_set
+        self.save_keyset_cursor()
+        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 5,
+                                            IndividualSearchEmails.get_action(_("Write to all"), "images/show.png"))
         if WrapAction.is_permission(self.request, 'contacts.add_abstractcontact'):
             self.get_components(self.field_id).add_action(self.request, ObjectMerge.get_action(_("Merge"), "images/clone.png"),
                                                           close=CLOSE_NO, unique=SELECT_MULTI, params={'modelname': self.model.get_long_name(), 'field_id': self.field_id})
@@ -382,8 +571,13 @@ class IndividualSearch(XferSavedCriteriaSearchEditor):
                         params={'modelname': self.model.get_long_name(), 'field_id': self.field_id}, pos_act=0)
 
 
+@MenuManage.describ('contacts.change_abstractcontact')
+class IndividualSearchEmails(ContactSearchEmails, IndividualSearch):
+    caption = _("Write to all")
+
+
 @MenuManage.describ('contacts.change_abstractcontact', FORMTYPE_NOMODAL, 'contact.actions', _('To find a legal entity following a set of criteria.'))
-class LegalEntitySearch(XferSavedCriteriaSearchEditor):
+class LegalEntitySearch(KeysetPagingGrid, XferSavedCriteriaSearchEditor):
     caption = _("Legal entity search")
     icon = "legalEntityFind.png"
     model = LegalEntity
@@ -393,9 +587,16 @@ class LegalEntitySearch(XferSavedCriteriaSearchEditor):
         XferSavedCriteriaSearchEditor.__init__(self, **kwargs)
         self.size_by_page = Params.getvalue("contacts-size-page")
 
+    def filter_items(self):
+        XferSavedCriteriaSearchEditor.filter_items(self)
+        self.items = self.get_keyset_items(self.items)
+
     def fillresponse(self):
         XferSearchEditor.fillresponse(self)
-        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 5)
+        self.items = self.keyset_items.query_set
+        self.save_keyset_cursor()
+        self.item.editor.add_email_selector(self, 0, self.get_max_row() + 1, 5,
+                                            LegalEntitySearchEmails.get_action(_("Write to all"), "images/show.png"))
         if WrapAction.is_permission(self.request, 'contacts.add_abstractcontact'):
             self.get_components(self.field_id).add_action(self.request, ObjectMerge.get_action(_("Merge"), "images/clone.png"),
                                                           close=CLOSE_NO, unique=SELECT_MULTI, params={'modelname': self.model.get_long_name(), 'field_id': self.field_id})
@@ -403,6 +604,11 @@ class LegalEntitySearch(XferSavedCriteriaSearchEditor):
                         params={'modelname': self.model.get_long_name(), 'field_id': self.field_id}, pos_act=0)
 
 
+@MenuManage.describ('contacts.change_abstractcontact')
+class LegalEntitySearchEmails(ContactSearchEmails, LegalEntitySearch):
+    caption = _("Write to all")
+
+
 @MenuManage.describ('contacts.add_abstractcontact')
 class AbstractContactFindDouble(XferListEditor):
     caption = _("Contact duplication searching")
@@ -413,6 +619,12 @@ class AbstractContactFindDouble(XferListEditor):
     def fillresponse_header(self):
         self.filter = self.model.get_query_for_duplicate()
 
+    def get_items_from_filter(self):
+        items = XferListEditor.get_items_from_filter(self)
+        if hasattr(items, 'with_final_children'):
+            items = items.with_final_children()
+        return items
+
     def fillresponse(self, modelname, field_id):
         if modelname is not None:
             self.model = apps.get_model(modelname)
@@ -431,6 +643,10 @@ class AbstractContactShow(XferShowEditor):
     field_id = 'abstractcontact'
     caption = _("Show contact")
 
+    def _search_model(self):
+        XferShowEditor._search_model(self)
+        LegalEntity.prefetch_members([self.item])
+
     def fillresponse(self, field_id):
         if field_id is not None:
             self.field_id = field_id
@@ -463,16 +679,8 @@ class AbstractContactDel(XferDelete):
 
 @signal_and_lock.Signal.decorate('post_merge')
 def post_merge_contacts(item):
-    from django.db.models import Count
-    if isinstance(item, LegalEntity):
-        individual_list = []
-        for ident in item.responsability_set.values('individual').annotate(Count('id')).values('individual').order_by().filter(id__count__gt=1):
-            individual_list.append(ident['individual'])
-        for individual_id in individual_list:
-            resp_list = item.responsability_set.filter(individual_id=individual_id).order_by('id')
-            main_resp = resp_list.first()
-            if main_resp is not None:
-                main_resp.merge_objects(list(resp_list)[1:])
+    if isinstance(item, AbstractContact):
+        Responsability.remove_duplicates([item.id])
 
 
 @signal_and_lock.Signal.decorate('situation')
@@ -512,12 +720,12 @@ def summary_contacts(xfer):
             lab.set_value_as_infocenter(_("Addresses and contacts"))
             lab.set_location(0, row, 4)
             xfer.add_component(lab)
-            nb_legal_entities = len(LegalEntity.objects.all())
+            nb_legal_entities = ContactCounterCache.get_count(LegalEntity)
             lbl_doc = XferCompLabelForm('lbl_nblegalentities')
             lbl_doc.set_location(0, row + 1, 4)
             lbl_doc.set_value_center(_("Total number of legal entities: %d") % nb_legal_entities)
             xfer.add_component(lbl_doc)
-            nb_individual = len(Individual.objects.all())
+            nb_individual = ContactCounterCache.get_count(Individual)
             lbl_doc = XferCompLabelForm('lbl_nbindividuals')
             lbl_doc.set_location(0, row + 2, 4)
             lbl_doc.set_value_center(_("Total number of individuals: %d") % nb_individual)
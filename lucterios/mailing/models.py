@@ -145,7 +145,7 @@ class Message(LucteriosModel):
         return MessageLineSet(hints={'body': self.body})
 
     def get_contact_noemail(self):
-        no_emails = self.get_contacts(False)
+        no_emails = self.get_contacts(False, final_child=True)
         return [six.text_type(no_email) for no_email in no_emails]
 
     @classmethod
@@ -162,7 +162,7 @@ class Message(LucteriosModel):
                 modelname, criteria = item.split(' ')
                 yield modelname, get_search_query_from_criteria(criteria, apps.get_model(modelname))
 
-    def get_contacts(self, email=None):
+    def get_contacts(self, email=None, final_child=False):
         def append_contact(new_contact):
             if new_contact not in contact_list:
                 contact_list.append(new_contact)
@@ -171,7 +171,7 @@ class Message(LucteriosModel):
             model = apps.get_model(modelname)
             contact_filter = item[0]
             if (email is not None) and (model.get_field_by_name('email') is None):
-                for contact in model.objects.filter(contact_filter).distinct():
+                for contact in self._get_final_contacts(model.objects.filter(contact_filter).distinct(), final_child):
                     if (email is True) and hasattr(contact, 'get_email') and (contact.get_email() != []):
                         append_contact(contact)
                     elif (email is False) and (not hasattr(contact, 'get_email') or (contact.get_email() == [])):
@@ -179,10 +179,16 @@ class Message(LucteriosModel):
             else:
                 if (email is not None) and (model.get_field_by_name('email') is not None):
                     contact_filter &= ~models.Q(email='') if email else models.Q(email='')
-                for contact in model.objects.filter(contact_filter).distinct():
+                for contact in self._get_final_contacts(model.objects.filter(contact_filter).distinct(), final_child):
                     append_contact(contact)
         return contact_list
 
+    @classmethod
+    def _get_final_contacts(cls, contacts, final_child):
+        if final_child and hasattr(contacts, 'with_final_children'):
+            contacts = contacts.with_final_children()
+        return contacts
+
     @property
     def recipients_description(self):
         for modelname, item in self.get_recipients():
@@ -289,28 +295,30 @@ class Message(LucteriosModel):
         self.http_root_address = http_root_address
         if will_mail_send() and (self.status == 2):
             email_list = self.email_to_send.split("\n")
+            contacts, items, contact_emails = self._get_sending_objects(email_list[:nb_to_send])
             for contact_email in email_list[:nb_to_send]:
                 contact_email_det = contact_email.split(':')
+                emails = None
                 if len(contact_email_det) == 2:
                     contact_id, email = contact_email_det
-                    try:
-                        contact = AbstractContact.objects.get(id=contact_id)
-                    except AbstractContact.DoesNotExist:
-                        contact = None
+                    contact = contacts.get(int(contact_id))
                 elif len(contact_email_det) == 3:
                     modelname, object_id, _printmodel = contact_email_det
-                    model = apps.get_model(modelname)
-                    item = model.objects.get(id=object_id)
+                    item = items[modelname].get(int(object_id))
                     if hasattr(item, 'contact'):
                         contact = item.contact
                     elif isinstance(item, AbstractContact):
                         contact = item
+                        emails = contact_emails.get(item.id)
                     else:
                         contact = None
                     email = contact_email
                 else:
                     continue
                 email_sent = EmailSent.objects.create(message=self, contact=contact, email=email, date=timezone.now())
+                email_sent.contact_emails = emails
+                if len(contact_email_det) == 3:
+                    email_sent._extract_obj(item)
                 email_sent.send_email(http_root_address)
             self.email_to_send = "\n".join(email_list[nb_to_send:])
             if self.email_to_send == '':
@@ -318,6 +326,26 @@ class Message(LucteriosModel):
             self.save()
         return
 
+    @classmethod
+    def _get_sending_objects(cls, email_list):
+        contact_ids = []
+        object_ids = {}
+        for contact_email in email_list:
+            contact_email_det = contact_email.split(':')
+            if len(contact_email_det) == 2:
+                contact_ids.append(int(contact_email_det[0]))
+            elif len(contact_email_det) == 3:
+                object_ids.setdefault(contact_email_det[0], []).append(int(contact_email_det[1]))
+        contacts = AbstractContact.objects.in_bulk(contact_ids)
+        items = {}
+        contact_emails = {}
+        for modelname, ids in object_ids.items():
+            model = apps.get_model(modelname)
+            items[modelname] = model.objects.in_bulk(ids)
+            if issubclass(model, AbstractContact) and model.has_bulk_emails():
+                contact_emails.update(AbstractContact.get_emails_by_contact(model.objects.filter(id__in=ids)))
+        return contacts, items, contact_emails
+
     def get_email_status(self):
         if not hasattr(self, '_email_status'):
             self._email_status = json.loads(self.email_sent)
@@ -376,6 +404,8 @@ class EmailSent(LucteriosModel):
     nb_open = models.IntegerField(verbose_name=_('number open'), null=False, default=0)
     sended_item = LucteriosVirtualField(verbose_name=_('sended item'), compute_from='get_sended_item')
 
+    contact_emails = None
+
     @classmethod
     def get_default_fields(cls):
         return ['contact', 'sended_item', 'date', 'success', 'error', 'last_open_date', 'nb_open']
@@ -391,11 +421,12 @@ class EmailSent(LucteriosModel):
         else:
             return self.email
 
-    def _extract_obj(self):
+    def _extract_obj(self, item=None):
         if len(self.email.split(':')) == 3:
             modelname, object_id, printmodel = self.email.split(':')
-            model = apps.get_model(modelname)
-            self.item = model.objects.get(id=object_id)
+            if item is None:
+                item = apps.get_model(modelname).objects.get(id=object_id)
+            self.item = item
             if hasattr(self.item, "get_pdfreport"):
                 self.print_file = [self.item.get_pdfreport(int(printmodel))]
             else:
@@ -417,8 +448,11 @@ class EmailSent(LucteriosModel):
         if not hasattr(self, 'item'):
             self._extract_obj()
         if self.item is not None:
-            cclist = self.item.get_email(False)
-            return self.item.get_email(True), cclist if len(cclist) > 0 else None
+            if self.contact_emails is not None:
+                email, cclist = self.contact_emails
+            else:
+                email, cclist = self.item.get_email(True), self.item.get_email(False)
+            return list(email), list(cclist) if len(cclist) > 0 else None
         else:
             return [self.email], None
 
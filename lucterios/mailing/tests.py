@@ -42,9 +42,9 @@ from lucterios.CORE.models import Parameter, LucteriosUser, PrintModel, Lucterio
 from lucterios.CORE.views_usergroup import UsersEdit
 from lucterios.CORE.views import AskPassword, AskPasswordAct
 
-from lucterios.contacts.tests_contacts import change_ourdetail, create_jack
+from lucterios.contacts.tests_contacts import change_ourdetail, create_jack, assert_num_queries
 from lucterios.contacts.views import CreateAccount
-from lucterios.contacts.models import Individual, LegalEntity
+from lucterios.contacts.models import Individual, LegalEntity, AbstractContact
 
 from lucterios.documents.tests import create_doc
 from lucterios.documents.models import DocumentContainer
@@ -580,6 +580,10 @@ class MailingTest(LucteriosTest):
         self.assert_observer('core.print', 'lucterios.mailing', 'messageLetter')
         self.save_pdf()
 
+        msg = Message.objects.create(subject='contacts', body='', recipients='contacts.AbstractContact id||8||1;2')
+        self.assertEqual([(1, AbstractContact), (2, AbstractContact)], sorted([(contact.id, contact.__class__) for contact in msg.get_contacts()]))
+        self.assertEqual([(1, LegalEntity), (2, Individual)], sorted([(contact.id, contact.__class__) for contact in msg.get_contacts(final_child=True)]))
+
     def test_letter_message_html(self):
         html_content = """
 {[p]}{[u]}{[b]}{[span style="font-size:24px;"]}Titre{[/span]}{[/b]}{[/u]}{[/p]}
@@ -864,7 +868,8 @@ Deque his rebus satis multa in nostris de re publica libris sunt dicta a Laelio.
             email_msg.save()
             self.assertEqual(0, server.count())
 
-            email_msg.sendemail(10, "http://testserver")
+            with assert_num_queries(self, 2, '"contacts_individual"."abstractcontact_ptr_id" = 4'):
+                email_msg.sendemail(10, "http://testserver")
             self.assertEqual(4, server.count())
             self.assertEqual('mr-sylvestre@worldcompany.com', server.get(0)[1])
             self.assertEqual(['avrel@worldcompany.com', 'mr-sylvestre@worldcompany.com'], server.get(0)[2])